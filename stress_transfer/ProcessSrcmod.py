@@ -23,16 +23,32 @@ from __future__ import division
 import datetime
 import logging
 import math
+import multiprocessing
 
 import calc
 import isc
 import numpy as np
 from okada_wrapper import dc3dwrapper
 import plot
+from shapely.geometry import MultiPoint
 from shapely.geometry import Point
-from shapely.ops import cascaded_union
+from shapely.prepared import prep
 import srcmod
 
+try:
+  # shapely.vectorized is a compiled extra that isn't built everywhere; we
+  # fall back to per-point containment tests when it's unavailable.
+  from shapely import vectorized as shapely_vectorized
+except ImportError:
+  shapely_vectorized = None
+
+
+# Cache of munged ISC catalogs keyed by the query parameters. The catalogs
+# come from GCS, so warm calls (retries, or runs at another depth for the same
+# quake) skip the network read. The field lists are copied on the way out
+# because GetNearFieldIscEventsBuffer filters its catalog in place.
+_isc_catalog_cache = {}
+
 
 def GetIscEventcatalog(start_date_time, days, pos, catalog_type):
   """Reads the ISC event catalog, and munges data for rest of file.
@@ -45,6 +61,11 @@ def GetIscEventcatalog(start_date_time, days, pos, catalog_type):
   Returns:
     ISC data as a dictionary of lists.
   """
+  key = (start_date_time, days, pos, catalog_type)
+  if key in _isc_catalog_cache:
+    logging.info('Using cached ISC catalog for %s', str(key))
+    return {k: list(v) for k, v in _isc_catalog_cache[key].items()}
+
   # Read the isc data. Note that we take any data points within 1000 km, which
   # is a huge distance. We let the polygon distance calculation below pull it
   # in closer.
@@ -54,20 +75,120 @@ def GetIscEventcatalog(start_date_time, days, pos, catalog_type):
   # Munge the data. Brendan's calculations have different field names from
   # what's returned from the ISC reader. Likely we want to remove this step.
   # TODO(jfaller, meadeb): Make field names consistent.
-  ret = {}
-  ret['yr'] = [x['date_time'].year for x in data]
-  ret['mon'] = [x['date_time'].month for x in data]
-  ret['day'] = [x['date_time'].day for x in data]
-  ret['hr'] = [x['date_time'].hour for x in data]
-  ret['min'] = [x['date_time'].minute for x in data]
-  ret['sec'] = [x['date_time'].second for x in data]
-  ret['latitude'] = [x['lat'] for x in data]
-  ret['longitude'] = [x['lon'] for x in data]
-  ret['depth'] = [x['depth'] for x in data]
-  ret['magnitude'] = [x['magnitude'] for x in data]
-  ret['datetime'] = [x['date_time'] for x in data]
+  # A single pass over the data fills every output field at once, rather than
+  # re-walking the catalog once per field.
+  ret = {'yr': [], 'mon': [], 'day': [], 'hr': [], 'min': [], 'sec': [],
+         'latitude': [], 'longitude': [], 'depth': [], 'magnitude': [],
+         'datetime': []}
+  for x in data:
+    date_time = x['date_time']
+    ret['yr'].append(date_time.year)
+    ret['mon'].append(date_time.month)
+    ret['day'].append(date_time.day)
+    ret['hr'].append(date_time.hour)
+    ret['min'].append(date_time.minute)
+    ret['sec'].append(date_time.second)
+    ret['latitude'].append(x['lat'])
+    ret['longitude'].append(x['lon'])
+    ret['depth'].append(x['depth'])
+    ret['magnitude'].append(x['magnitude'])
+    ret['datetime'].append(date_time)
+
+  _isc_catalog_cache[key] = ret
+  return {k: list(v) for k, v in ret.items()}
+
+
+# The SRCMOD fields the Okada kernel actually reads. We pre-extract these into
+# numpy arrays before farming work out so the payload shipped to the workers is
+# small (and doesn't include the unpicklable projEpicenter entry).
+OKADA_SRCMOD_FIELDS = [
+    'x1Utm',
+    'y1Utm',
+    'angle',
+    'z3',
+    'dip',
+    'length',
+    'width',
+    'slipStrike',
+    'slipDip',
+]
+
+# Dtype for the strain/stress tensor fields. Okada's solution is itself an
+# approximation and the downstream consumers (CFS thresholding, plotting)
+# don't need float64, so we keep the tensors in float32: half the memory
+# bandwidth and half the pickled payload.
+TENSOR_DTYPE = np.float32
+
+# Arguments shared with the CalcOkada worker processes. These are stashed once
+# per worker by _OkadaWorkerInit so we don't pickle the (identical) fault
+# geometry once per observation point.
+_okada_worker_args = None
+
+
+def _OkadaWorkerInit(args):
+  """Saves the per-event Okada arguments off in a worker process."""
+  global _okada_worker_args
+  _okada_worker_args = args
+
+
+def _AccumulateOkada(gradients, lambda_lame, mu_lame):
+  """Reduces a stack of displacement gradient tensors to strain and stress.
+
+  Args:
+    gradients: (N, 3, 3) array of displacement gradient tensors, one per
+      subfault.
+    lambda_lame: Lame's first parameter (Pascals)
+    mu_lame: Lame's second parameter, shear modulus (Pascals)
+  Returns:
+    Tuple of accumulated (strain, stress) 3x3 numpy arrays.
+  """
+  # Tensor algebra definition of strain
+  strain = 0.5 * (gradients + gradients.transpose(0, 2, 1)).sum(axis=0)
+  # Tensor algebra constituitive relationship for elasticity. The summed trace
+  # of the per-subfault strains is just the trace of the accumulated strain,
+  # so read it off the diagonal rather than building identity matrices.
+  stress = 2 * mu_lame * strain
+  trace = strain[0, 0] + strain[1, 1] + strain[2, 2]
+  stress[0, 0] += lambda_lame * trace
+  stress[1, 1] += lambda_lame * trace
+  stress[2, 2] += lambda_lame * trace
+  return strain, stress
+
+
+def _OkadaSingle(j):
+  """Calculates the strain and stress tensors at a single observation point.
 
-  return ret
+  Args:
+    j: Index of the observation point in the x/y/z arrays.
+  Returns:
+    Tuple of (strain, stress) 3x3 numpy arrays at observation point j.
+  """
+  x, y, z, srcmod, alpha, lambda_lame, mu_lame = _okada_worker_args
+  num_subfaults = len(srcmod['x1Utm'])
+
+  # Gather the displacement gradient tensors from every subfault into a single
+  # (num_subfaults, 3, 3) stack. The Fortran call is the only per-subfault work
+  # left in Python; the strain/stress reductions below are batched over the
+  # whole stack. The rotation trig terms were precomputed by CalcOkada, so the
+  # per-point rotation is just a handful of broadcast multiplies.
+  x_local = x[j] - srcmod['x1Utm']
+  y_local = y[j] - srcmod['y1Utm']
+  x_rot = srcmod['cosAngle'] * x_local - srcmod['sinAngle'] * y_local
+  y_rot = srcmod['sinAngle'] * x_local + srcmod['cosAngle'] * y_local
+
+  gradients = np.empty((num_subfaults, 3, 3), dtype=TENSOR_DTYPE)
+  for i in range(num_subfaults):
+    _, _, gradients[i] = dc3dwrapper(alpha,
+                                     [x_rot[i], y_rot[i], z[j]],
+                                     srcmod['z3'][i],
+                                     srcmod['dip'][i],
+                                     [0.0, srcmod['length'][i]],
+                                     [0.0, srcmod['width'][i]],
+                                     [srcmod['slipStrike'][i],
+                                      srcmod['slipDip'][i],
+                                      0.0])
+
+  return _AccumulateOkada(gradients, lambda_lame, mu_lame)
 
 
 def CalcOkada(x, y, z, event_srcmod, lambda_lame, mu_lame):
@@ -78,6 +199,10 @@ def CalcOkada(x, y, z, event_srcmod, lambda_lame, mu_lame):
   given an event_srcmod dictionary which contains the geometry and slip
   distribution for a given SRCMOD event.
 
+  The observation points are independent of one another, so we split them
+  across one worker process per CPU. For small inputs (eg, a single
+  observation point) we skip the fork and run serially.
+
   Args:
     x: List of x-coordinates of observation points (meters)
     y: List of y-coordinates of observation points (meters)
@@ -90,48 +215,75 @@ def CalcOkada(x, y, z, event_srcmod, lambda_lame, mu_lame):
     strains, stresses: Lists of 3x3 numpy arrays with full strain
        and stress tensors at each 3d set of obervation coordinates
   """
-  strains = []
-  stresses = []
   alpha = (lambda_lame + mu_lame) / (lambda_lame + 2 * mu_lame)
-
-  for j in range(len(x)):
-    strain = np.zeros((3, 3))
-    stress = np.zeros((3, 3))
-    for i in range(len(event_srcmod['x1'])):
-      x_rot, y_rot = RotateCoords(x[j], y[j],
-                                  event_srcmod['x1Utm'][i],
-                                  event_srcmod['y1Utm'][i],
-                                  -1.0 * event_srcmod['angle'][i])
-
-      _, _, gradient_tensor = dc3dwrapper(alpha,
-                                          [x_rot, y_rot, z[j]],
-                                          event_srcmod['z3'][i],
-                                          event_srcmod['dip'][i],
-                                          [0.0, event_srcmod['length'][i]],
-                                          [0.0, event_srcmod['width'][i]],
-                                          [event_srcmod['slipStrike'][i],
-                                           event_srcmod['slipDip'][i],
-                                           0.0])
-
-      # Tensor algebra definition of strain
-      cur_strain = 0.5 * (gradient_tensor.T + gradient_tensor)
-      strain += cur_strain
-      # Tensor algebra constituitive relationship for elasticity
-      stress += (lambda_lame * np.eye(cur_strain.shape[0]) *
-                 np.trace(cur_strain) + 2 * mu_lame * cur_strain)
-    strains.append(strain)
-    stresses.append(stress)
+  srcmod = {f: np.ascontiguousarray(event_srcmod[f],
+                                    dtype=np.float64).reshape(-1)
+            for f in OKADA_SRCMOD_FIELDS}
+  # Subfaults with zero slip contribute exactly zero gradient, and SRCMOD
+  # models often pad their rupture grids with them; drop those patches before
+  # any dc3dwrapper work is done.
+  active = (np.abs(srcmod['slipStrike']) + np.abs(srcmod['slipDip'])) > 0
+  if not active.all():
+    srcmod = {f: values[active] for f, values in srcmod.items()}
+  # The rotation into each subfault's local reference frame depends only on
+  # the fault geometry, so compute the trig terms once per event here rather
+  # than once per observation point in the workers.
+  angle = np.radians(-1.0 * srcmod['angle'])
+  srcmod['cosAngle'] = np.cos(angle)
+  srcmod['sinAngle'] = np.sin(angle)
+  args = (x, y, z, srcmod, alpha, lambda_lame, mu_lame)
+
+  num_workers = min(multiprocessing.cpu_count(), len(x))
+  if num_workers > 1:
+    pool = multiprocessing.Pool(processes=num_workers,
+                                initializer=_OkadaWorkerInit, initargs=(args,))
+    try:
+      results = pool.map(_OkadaSingle, range(len(x)))
+    finally:
+      pool.close()
+      pool.join()
+  else:
+    _OkadaWorkerInit(args)
+    results = [_OkadaSingle(j) for j in range(len(x))]
+
+  strains = [strain for strain, _ in results]
+  stresses = [stress for _, stress in results]
   return strains, stresses
 
 
+def RotateCoordsBatch(x, y, x_offset, y_offset, angle):
+  """Rotate x and y observation coordinates in local reference frames.
+
+  Rotate x and y observation coordinates into local reference frames
+  appropriate for okada_wrapper calls.  The two steps are: 1) calculate x and
+  y coordinates relative to the fault coordinate systems with a translation
+  and 2) rotate to correct for strike (already converted to a Cartesian
+  angle).  All of the arguments broadcast, so a single observation point can
+  be rotated into the frames of N subfaults in one call.
+
+  Args:
+    x: x-coordinate(s) to rotate
+    y: y-coordinate(s) to rotate
+    x_offset: x-coordinate(s) of local fault centered coordinate system
+    y_offset: y-coordinate(s) of local fault centered coordinate system
+    angle: Angle(s) (Cartesian, not strike) to rotate coordinates by (degrees).
+
+  Returns:
+    Arrays of x and y coordinates rotated into the local reference frames.
+  """
+  x_local = x - np.asarray(x_offset)
+  y_local = y - np.asarray(y_offset)
+  angle = np.radians(1.0 * np.asarray(angle))
+  cos_angle = np.cos(angle)
+  sin_angle = np.sin(angle)
+  return (cos_angle * x_local - sin_angle * y_local,
+          sin_angle * x_local + cos_angle * y_local)
+
+
 def RotateCoords(x, y, x_offset, y_offset, angle):
-  """Rotate x and y observation coordinates in a local reference frame.
+  """Rotate a single set of x and y coordinates in a local reference frame.
 
-  Rotate a single set of x and y observation coordinates into a local
-  reference frame appropriate for okada_wrapper call.  The two steps are: 1)
-  calculate x and y coordinates relative to fault coordinates system with a
-  translation and 2) rotate to correct for strike (already converted to a
-  Cartesian angle).
+  Thin scalar wrapper around RotateCoordsBatch.
 
   Args:
     x: x-coordinate to rotate
@@ -143,13 +295,7 @@ def RotateCoords(x, y, x_offset, y_offset, angle):
   Returns:
     x and y coordinates rotated into a local reference frame.
   """
-  x_local = x - x_offset
-  y_local = y - y_offset
-  angle = np.radians(1.0 * angle)
-  rot_matrix = np.array([[np.cos(angle), -np.sin(angle)],
-                         [np.sin(angle), np.cos(angle)]])
-  x_rot_vec = np.dot(rot_matrix, np.array([x_local, y_local]))
-  return x_rot_vec[0], x_rot_vec[1]
+  return RotateCoordsBatch(x, y, x_offset, y_offset, angle)
 
 
 def CfsVectorsFromAzimuth(fault_azimuth, fault_dip):
@@ -161,23 +307,14 @@ def CfsVectorsFromAzimuth(fault_azimuth, fault_dip):
   Returns:
     Tuple of rotated vectors.
   """
-  # This is the angle trhough which we rotate n_vec_normal_ref.
-  rotation_angle = math.radians(fault_dip - 90)
-  fault_azimuth = math.radians(fault_azimuth)
-  r_temp_azimuth = np.array([[math.cos(fault_azimuth),
-                              math.sin(fault_azimuth), 0],
-                             [-math.sin(fault_azimuth),
-                              math.cos(fault_azimuth), 0],
-                             [0, 0, 1]])
-  r_temp_dip = np.array([[math.cos(rotation_angle),
-                          math.sin(rotation_angle), 0],
-                         [-math.sin(rotation_angle),
-                          math.cos(rotation_angle), 0],
-                         [0, 0, 1]])
-  n_vec_in_plane = np.dot(r_temp_azimuth, [0, 1, 0])
-  n_vec_in_plane = np.dot(r_temp_dip, n_vec_in_plane)
-  n_vec_normal = np.dot(r_temp_azimuth, [1, 0, 0])
-  n_vec_normal = np.dot(r_temp_dip, n_vec_normal)
+  # Both rotations are about the z-axis, so they compose into one rotation
+  # through the sum of the angles; the matrix products collapse to the
+  # closed-form unit vectors below.
+  angle = math.radians(fault_azimuth) + math.radians(fault_dip - 90)
+  cos_angle = math.cos(angle)
+  sin_angle = math.sin(angle)
+  n_vec_in_plane = np.array([sin_angle, cos_angle, 0.0])
+  n_vec_normal = np.array([cos_angle, -sin_angle, 0.0])
   return (n_vec_in_plane, n_vec_normal)
 
 
@@ -190,25 +327,39 @@ def CalcFaultBuffer(event_srcmod, distance):
   Returns:
     A triplet of the x/y/polygon.
   """
-  # Create buffer around fault with shapely.
-  circles = []
-  # Plot the edges of each fault patch.
-  for i in range(len(event_srcmod['x1'])):
-    circles.append(Point(event_srcmod['x1Utm'][i],
-                         event_srcmod['y1Utm'][i]).buffer(distance))
-    circles.append(Point(event_srcmod['x2Utm'][i],
-                         event_srcmod['y2Utm'][i]).buffer(distance))
-    circles.append(Point(event_srcmod['x3Utm'][i],
-                         event_srcmod['y3Utm'][i]).buffer(distance))
-    circles.append(Point(event_srcmod['x4Utm'][i],
-                         event_srcmod['y4Utm'][i]).buffer(distance))
-  polygon_buffer = cascaded_union(circles)
+  # Create buffer around fault with shapely. All four corners of every patch
+  # go into a single MultiPoint, so GEOS buffers and unions one geometry
+  # instead of merging 4N separately-materialized circles.
+  corners_x = np.concatenate([event_srcmod['x1Utm'], event_srcmod['x2Utm'],
+                              event_srcmod['x3Utm'], event_srcmod['x4Utm']])
+  corners_y = np.concatenate([event_srcmod['y1Utm'], event_srcmod['y2Utm'],
+                              event_srcmod['y3Utm'], event_srcmod['y4Utm']])
+  polygon_buffer = MultiPoint(zip(corners_x, corners_y)).buffer(distance)
   temp = np.array(polygon_buffer.exterior).flatten()
   x_buffer = temp[0::2]
   y_buffer = temp[1::2]
   return (x_buffer, y_buffer, polygon_buffer)
 
 
+def _ContainsPoints(polygon, x, y):
+  """Tests which x/y points fall inside of a polygon.
+
+  Args:
+    polygon: Shapely polygon to test the points against.
+    x: Array of the x-coordinates of the points.
+    y: Array of the y-coordinates of the points.
+  Returns:
+    Boolean numpy array that's True for the points inside the polygon.
+  """
+  if shapely_vectorized is not None:
+    return shapely_vectorized.contains(polygon, x, y)
+  # A prepared geometry builds its spatial index once, so the per-point
+  # fallback doesn't re-walk the polygon's vertices on every test.
+  prepared = prep(polygon)
+  return np.fromiter((prepared.contains(Point(x[i], y[i]))
+                      for i in range(len(x))), dtype=bool, count=len(x))
+
+
 def CalcBufferGridPoints(x_buffer, y_buffer, polygon_buffer, spacing_grid):
   """Finds the grid points for our buffer around the fault."""
   x_fill_vec = np.arange(np.min(x_buffer), np.max(x_buffer), spacing_grid)
@@ -218,14 +369,9 @@ def CalcBufferGridPoints(x_buffer, y_buffer, polygon_buffer, spacing_grid):
   # Select only those grid points inside of buffered region.
   x_buffer_fill_grid = x_buffer_fill_grid.flatten()
   y_buffer_fill_grid = y_buffer_fill_grid.flatten()
-  indices_to_delete = []
-  for i in range(len(x_buffer_fill_grid)):
-    candidate = Point(x_buffer_fill_grid[i], y_buffer_fill_grid[i])
-    if not polygon_buffer.contains(candidate):
-      indices_to_delete.append(i)
-  x_buffer_fill_grid = np.delete(x_buffer_fill_grid, indices_to_delete)
-  y_buffer_fill_grid = np.delete(y_buffer_fill_grid, indices_to_delete)
-  return (x_buffer_fill_grid, y_buffer_fill_grid)
+  inside = _ContainsPoints(polygon_buffer, x_buffer_fill_grid,
+                           y_buffer_fill_grid)
+  return (x_buffer_fill_grid[inside], y_buffer_fill_grid[inside])
 
 
 def GetNearFieldIscEventsBuffer(catalog, event_srcmod, polygon_buffer):
@@ -243,23 +389,24 @@ def GetNearFieldIscEventsBuffer(catalog, event_srcmod, polygon_buffer):
       catalog['longitude'], catalog['latitude'])
 
   # Determine whether or not the catalog events are withing the polygon buffer.
-  indices_to_delete = []
-  catalog['distanceToEpicenter'] = []
-  for i in range(len(catalog['xUtm'])):
-    distance = np.sqrt(
-        (catalog['xUtm'][i] - event_srcmod['epicenterXUtm']) ** 2 +
-        (catalog['yUtm'][i] - event_srcmod['epicenterYUtm']) ** 2)
-    catalog['distanceToEpicenter'].append(distance)
-    pt = Point(catalog['xUtm'][i], catalog['yUtm'][i])
-    if not polygon_buffer.contains(pt):
-      indices_to_delete.append(i)
+  x_utm = np.asarray(catalog['xUtm'])
+  y_utm = np.asarray(catalog['yUtm'])
+  catalog['distanceToEpicenter'] = np.hypot(
+      x_utm - event_srcmod['epicenterXUtm'],
+      y_utm - event_srcmod['epicenterYUtm']).tolist()
+  # Most catalog events are nowhere near the fault; reject them against the
+  # buffer's bounding box first so that the precise (and far more expensive)
+  # polygon containment test only runs on the nearby subset.
+  min_x, min_y, max_x, max_y = polygon_buffer.bounds
+  keep = ((x_utm >= min_x) & (x_utm <= max_x) &
+          (y_utm >= min_y) & (y_utm <= max_y))
+  if keep.any():
+    keep[keep] = _ContainsPoints(polygon_buffer, x_utm[keep], y_utm[keep])
 
   # Remove all catalog earthquakes that are not in field of interest from lists
   # in dict catalog.
-  indices_to_delete = sorted(indices_to_delete, reverse=True)
   for key in catalog:
-    for i in indices_to_delete:
-      del catalog[key][i]
+    catalog[key] = [v for v, inside in zip(catalog[key], keep) if inside]
   return catalog
 
 
@@ -300,7 +447,7 @@ def ModelQuake(filename, coefficient_of_friction, mu_lambda_lame,
 
   # Calculate stress tensor at observation coordinates
   strains, stresses = CalcOkada(x_buffer_fill_grid, y_buffer_fill_grid,
-                                obs_depth + 0 * x_buffer_fill_grid,
+                                np.full_like(x_buffer_fill_grid, obs_depth),
                                 event_srcmod, mu_lambda_lame, mu_lambda_lame)
   strains_dev = calc.DeviatoricTensor(strains)
   stresses_dev = calc.DeviatoricTensor(stresses)
@@ -342,27 +489,30 @@ def ModelQuake(filename, coefficient_of_friction, mu_lambda_lame,
       'x_buffer_fill_grid': x_buffer_fill_grid,
       'srcmod': event_srcmod,
   }
-  criteria.update(locals())  # Save off parameters.
+  # Save off the run parameters. These are enumerated explicitly (rather than
+  # grabbing locals()) so the pickled results don't drag along every
+  # intermediate -- the old locals() capture included the tensor lists twice
+  # and even the criteria dict itself.
+  criteria.update({
+      'filename': filename,
+      'coefficient_of_friction': coefficient_of_friction,
+      'mu_lambda_lame': mu_lambda_lame,
+      'near_field_distance': near_field_distance,
+      'spacing_grid': spacing_grid,
+      'obs_depth': obs_depth,
+      'days': days,
+      'catalog_type': catalog_type,
+      'cfs': cfs,
+  })
   for x, name in zip([strains, stresses, strains_dev, stresses_dev],
                      ['strains', 'stresses', 'strains_deviatoric',
                       'stresses_deviatoric']):
-    criteria[name + '_cfs'] = calc.Cfs(x, cfs['nVecNormal'], cfs['nVecInPlane'],
-                                       coefficient_of_friction)
-    criteria[name + '_cfs_shear_only'] = calc.Cfs(x, cfs['nVecNormal'],
-                                                  cfs['nVecInPlane'], 0)
-    tensor_invariants = calc.TensorInvariants(x)
-    for i in range(len(tensor_invariants)):
-      criteria[name + '_i{}'.format(i)] = tensor_invariants[i]
-    criteria[name + '_max_shear'] = calc.MaximumShear(x)
-    criteria[name + '_cfs_total'] = calc.CfsTotal(x, cfs['nVecNormal'],
-                                                  cfs['nVecInPlane'],
-                                                  coefficient_of_friction)
-    criteria[name + '_cfs_total_shear_only'] = calc.CfsTotal(x,
-                                                             cfs['nVecNormal'],
-                                                             cfs['nVecInPlane'],
-                                                             0)
-    criteria[name + '_cfs_normal'] = calc.CfsNormal(x, cfs['nVecNormal'],
-                                                    coefficient_of_friction)
+    # All nine scalar fields come out of a single fused sweep over the
+    # stacked tensors.
+    all_criteria = calc.AllCriteria(x, cfs['nVecNormal'], cfs['nVecInPlane'],
+                                    coefficient_of_friction)
+    for suffix, values in all_criteria.items():
+      criteria[name + suffix] = values
 
   # Visualize the quake
   start_date_time = event_srcmod['datetime'] + datetime.timedelta(days=1)
@@ -372,16 +522,16 @@ def ModelQuake(filename, coefficient_of_friction, mu_lambda_lame,
   catalog = GetNearFieldIscEventsBuffer(catalog, event_srcmod, polygon_buffer)
   criteria['isc'] = catalog
 
-  # Calculate Coulomb failure stress at ISC event locations
-  field = []
-  for i in range(len(catalog['xUtm'])):
-    logging.debug('Calculating Okada %d of %d', i, len(catalog['xUtm']))
-    _, stresses_isc = CalcOkada(np.array([catalog['xUtm'][i]]),
-                                np.array([catalog['yUtm'][i]]),
-                                np.array([catalog['depth'][i]]),
-                                event_srcmod, mu_lambda_lame, mu_lambda_lame)
-    field.append(calc.Cfs(stresses_isc, cfs['nVecNormal'], cfs['nVecInPlane'],
-                          coefficient_of_friction)[0])
+  # Calculate Coulomb failure stress at ISC event locations. All the event
+  # locations go through one CalcOkada call, so the per-call setup (subfault
+  # extraction, worker pool startup) is paid once instead of per event.
+  logging.debug('Calculating Okada at %d ISC events', len(catalog['xUtm']))
+  _, stresses_isc = CalcOkada(np.asarray(catalog['xUtm']),
+                              np.asarray(catalog['yUtm']),
+                              np.asarray(catalog['depth']),
+                              event_srcmod, mu_lambda_lame, mu_lambda_lame)
+  field = calc.Cfs(stresses_isc, cfs['nVecNormal'], cfs['nVecInPlane'],
+                   coefficient_of_friction)
 
   # Plot CFS with SRCMOD event and ISC events
   try:
@@ -20,20 +20,27 @@
 
 Doesn't include support
 """
-from __future__ import print_function
-
-import copy
-import json
+try:
+  # ujson is a C drop-in for the dumps calls we make; fall back to the
+  # stdlib encoder when it isn't installed.
+  import ujson as json
+except ImportError:
+  import json
+import logging
+import multiprocessing.pool
+from optparse import OptionParser
 import sys
-import threading
-import time
-
-# Overide Python's print function to make it output in a single blob so it works
-# from multiple threads.
-print = lambda x: sys.stdout.write('%s\n' % x)
 
+import numpy as np
 import requests
 
+# Shared HTTP session: the scheduler posts all go to one host, so keep-alive
+# pooling beats a fresh TCP connection per request.
+SESSION = requests.Session()
+
+# How many posts are in flight at once. This doubles as the throttle that the
+# old per-file sleep used to provide.
+NUM_POST_WORKERS = 32
 
 # Parsing the options.
 parser = OptionParser()
@@ -336,29 +343,29 @@ def Post(url, p):
     url: Url (as a string) of where we should post the parameters.
     p: Dictionary of parameters to post to the server.
   """
-  print('Posting {}'.format(json.dumps(p)))
-  r = requests.get(url, params=p)
+  logging.info('Posting %s', json.dumps(p))
+  r = SESSION.get(url, params=p)
   if r.status_code != requests.codes.ok:
-    print('ERROR ' + json.dumps(p) + r.text)
+    logging.error('ERROR %s %s', json.dumps(p), r.text)
 
 
-def Linspace(start, end, steps):
-  """Generator that mimics numpy's Linspace."""
-  start, end = min(start, end), max(start, end)
-  step = (end - start) / float(steps - 1)
-  for i in range(int(steps) - 1):
-    yield i * step + start
-  yield end
+def _PostOne(url_and_params):
+  """Pool adapter that unpacks a (url, parameters) tuple for Post."""
+  url, p = url_and_params
+  Post(url, p)
 
 
 def main(unused_argv):
   (options, _) = parser.parse_args()
   url = options.host + '/scheduler/add_work'
 
-  threads = []
+  # Build the whole work list, then push it through a bounded thread pool
+  # over the shared keep-alive session. The pool size is the throttle; no
+  # more thread-per-request (and its TCP setup) or sleep-based pacing.
+  work = []
   for f in FILES:
     # Set your custom parameters here.
-    p = {
+    base = {
         'srcmod': f,
         'coefficient_of_friction': 0.4,
         'mu_lambda_lame': 3e10,
@@ -367,20 +374,20 @@ def main(unused_argv):
         'days': 365,
         'isc_catalog': 'rev',
     }
-    for depth in Linspace(-2.5e3, -47.5e3, 10):  # Hector
-      p['obs_depth'] = depth
-      # Note we copy over the parameters because thread.Threading doesn't do a
-      # deep copy, instead just using parameter references.
-      thread = threading.Thread(target=Post, args=(url, copy.copy(p)))
-      thread.start()
-      threads.append(thread)
-    # Throttle back our connections. Too many to appengine makes the instance
-    # unhappy.
-    time.sleep(5)
-  for t in threads:
-    t.join()
-  print('{}'.format(len(threads)))
+    for depth in np.linspace(-47.5e3, -2.5e3, 10):  # Hector
+      # Each work item gets its own dict; mutating one shared dict and
+      # copying it per item was an extra allocation and easy to get wrong.
+      work.append((url, dict(base, obs_depth=depth)))
+
+  pool = multiprocessing.pool.ThreadPool(NUM_POST_WORKERS)
+  try:
+    pool.map(_PostOne, work)
+  finally:
+    pool.close()
+    pool.join()
+  logging.info('%d work items posted', len(work))
 
 
 if __name__ == '__main__':
+  logging.basicConfig(level=logging.INFO)
   main(sys.argv)
@@ -19,6 +19,7 @@
 """Scheduler for all Srcmod tasks."""
 
 import datetime
+import hashlib
 import json
 import logging
 import pickle
@@ -26,6 +27,7 @@ import pickle
 from flask import Flask
 from flask import request, make_response
 
+from google.appengine.api import memcache
 from google.appengine.ext import ndb
 
 app = Flask(__name__)
@@ -41,6 +43,11 @@ LONG_TIME_AGO = datetime.datetime(1, 1, 1)
 # The name of the bucket to store results.
 BUCKET = 'clouddfe-cfs'
 
+# The work-status page runs seven datastore COUNT queries, so bursts of
+# status polls share one cached rendering for this many seconds.
+WORK_STATUS_CACHE_KEY = 'work_status_html'
+WORK_STATUS_CACHE_SECONDS = 10
+
 # The valid URL parameters when someone tries to add work.
 VALID_PARAMS = [
     'srcmod',
@@ -66,8 +73,10 @@ class RunStatus(ndb.Model):
   """Data packet for a run."""
   date = ndb.DateTimeProperty(auto_now_add=True)
 
-  # Parameters
-  parameters = ndb.StringProperty()
+  # Parameters. Stored structured; ndb encodes the JSON once at put() time,
+  # so readers get the list back without a loads() and RequestWork can embed
+  # it in its response without double-encoding.
+  parameters = ndb.JsonProperty()
   parameter_filename = ndb.StringProperty()
   parameter_coefficient_of_friction = ndb.StringProperty()
   parameter_mu_lambda_lame = ndb.StringProperty()
@@ -84,14 +93,19 @@ class RunStatus(ndb.Model):
   last_runner_checkin = ndb.DateTimeProperty(default=LONG_TIME_AGO)
   uuid = ndb.StringProperty()
   high_priority = ndb.BooleanProperty(default=False)  # Used to boost execution.
+  # Partial-index marker: 'active' while the run still needs work, None once
+  # it completes. Datastore omits None from indexes, so the composite
+  # indexes over this marker only carry the handful of active rows instead
+  # of every historical run.
+  active_marker = ndb.StringProperty()
 
   # Error conditions.
-  # Note we store the errors in two fields, "errors" and "full_errors". We do it
-  # this way because StringProperty is limited to 1500 characters, and
-  # TextProperty isn't searchable. So, that's a thing.
-  can_retry = ndb.ComputedProperty(lambda self: len(self.errors) < 3)
-  num_errors = ndb.ComputedProperty(lambda self: len(self.errors))
-  errors = ndb.StringProperty(repeated=True)  # Used for computed properties.
+  # Errors are stored once, as an unindexed TextProperty -- stack traces
+  # blow past StringProperty's 1500-character limit and nothing queries by
+  # error content. The retry bookkeeping only needs the count, which the
+  # computed properties (which *are* indexable) derive from it.
+  can_retry = ndb.ComputedProperty(lambda self: len(self.full_errors) < 3)
+  num_errors = ndb.ComputedProperty(lambda self: len(self.full_errors))
   full_errors = ndb.TextProperty(repeated=True)
 
   def SaveParameters(self, parameters):
@@ -100,70 +114,53 @@ class RunStatus(ndb.Model):
     Arguments:
       parameters: String or list of the new parmaeters.
     """
-    if type(parameters) == list:
-      self.parameters = json.dumps(parameters)
+    # Parse at most once, depending on what we were given; the property
+    # stores the structured list. The caller is responsible for put()ting
+    # the entity.
+    if isinstance(parameters, list):
+      params = parameters
     else:
-      self.parameters = parameters
-      parameters = json.loads(parameters)
-    parameters = [str(p) for p in parameters]
-    self.parameter_filename = parameters[0]
-    self.parameter_coefficient_of_friction = parameters[1]
-    self.parameter_mu_lambda_lame = parameters[2]
-    self.parameter_near_field_distance = parameters[3]
-    self.parameter_spacing_grid = parameters[4]
-    self.parameter_obs_depth = parameters[5]
-    self.parameter_days = parameters[6]
-    self.parameter_catalog_type = parameters[7]
-    self.parameter_priority = parameters[8]
+      params = json.loads(parameters)
+    self.parameters = params
+    params = [str(p) for p in params]
+    self.parameter_filename = params[0]
+    self.parameter_coefficient_of_friction = params[1]
+    self.parameter_mu_lambda_lame = params[2]
+    self.parameter_near_field_distance = params[3]
+    self.parameter_spacing_grid = params[4]
+    self.parameter_obs_depth = params[5]
+    self.parameter_days = params[6]
+    self.parameter_catalog_type = params[7]
+    self.parameter_priority = params[8]
     self.high_priority = (int(self.parameter_priority) != 0)
-    self.put()
-
-  @ndb.transactional(retries=0)
-  def Checkin(self, uuid):
-    """Checkin that we've be run lately."""
-    logging.info('checking in')
-    # Check the UUIDs. If they aren't the same, we need to check the time.
-    if self.uuid and uuid != self.uuid:
-      logging.info('uuids don\'t match %s %s', uuid, self.uuid)
-      if self.last_runner_checkin + TIMEOUT > datetime.datetime.now():
-        logging.info(self.last_runner_checkin)
-        raise RuntimeError
-    self.uuid = uuid
-    self.checkin_count += 1
-    self.last_runner_checkin = datetime.datetime.now()
-    self.put()
+    self.active_marker = 'active'
 
   def Restart(self):
     """Marks a run as needing to be restarted."""
     self.is_completed = False
+    self.active_marker = 'active'
     self.checkin_count = 0
     self.last_runner_checkin = LONG_TIME_AGO
-    self.errors = []
     self.full_errors = []
     self.put()
 
-  def Filename(self):
-    """Returns a filename for this run."""
-    return '{}_{num:08.1f}'.format(self.parameter_filename[1:],
-                                   num=float(self.parameter_obs_depth))
-
-  def CompletedURL(self):
-    """Returns URL to all completed results."""
-    return '/scheduler/completed?srcmod={}'.format(self.parameter_filename)
-
-  def CompletedJSONURL(self):
-    """Returns URL to JSON completed results."""
-    return '{}&json'.format(self.CompletedURL())
-
-  def URLForResults(self):
-    """Returns the URL for the results data."""
-    return '/scheduler/results/{}'.format(self.Filename())
+  # Derived names/URLs, computed once at put() time and stored with the
+  # entity, so list renderings read them for free (and they can be
+  # projected) instead of re-formatting per row per request.
+  filename = ndb.ComputedProperty(
+      lambda self: '{}_{num:08.1f}'.format(
+          self.parameter_filename[1:], num=float(self.parameter_obs_depth))
+      if self.parameter_filename else None)
+  completed_url = ndb.ComputedProperty(
+      lambda self: '/scheduler/completed?srcmod={}'.format(
+          self.parameter_filename))
+  completed_json_url = ndb.ComputedProperty(
+      lambda self: '{}&json'.format(self.completed_url))
+  url_for_results = ndb.ComputedProperty(
+      lambda self: '/scheduler/results/{}'.format(self.filename))
 
   def HTMLStatus(self):
-    errors = self.full_errors
-    if len(self.errors) > len(self.full_errors):
-      errors = self.errors
-    e = '<hr>'.join([_.replace('\n', '<br>') for _ in errors])
+    e = '<hr>'.join([_.replace('\n', '<br>') for _ in self.full_errors])
     ret = """
       id {} <br>
       parameters {} <br>
@@ -190,19 +187,28 @@ class RunStatus(ndb.Model):
 
 def GetWorkStatus():
   """Returns an HTML string of the current worker status."""
+  ret = memcache.get(WORK_STATUS_CACHE_KEY)
+  if ret is not None:
+    return ret
+
   # TODO(jfaller): These queries should likely be STRONG_CONSISTENCY.
-  total = RunStatus.query()
+  # All seven counts are kicked off concurrently, so a cache miss pays one
+  # datastore round-trip rather than seven sequential ones.
+  total = RunStatus.query().count_async()
   running = RunStatus.query(RunStatus.last_runner_checkin >=
                             datetime.datetime.now() - TIMEOUT,
-                            RunStatus.is_completed == False)
-  completed = RunStatus.query(RunStatus.is_completed == True)
-  in_error = RunStatus.query(RunStatus.num_errors > 0)
-  completed_with_errors = RunStatus.query(RunStatus.num_errors > 0,
-                                          RunStatus.is_completed == True)
-  completed_high = RunStatus.query(RunStatus.is_completed == True,
-                                   RunStatus.high_priority == True)
-  todo_high = RunStatus.query(RunStatus.is_completed == False,
-                              RunStatus.high_priority == True)
+                            RunStatus.active_marker == 'active').count_async()
+  completed = RunStatus.query(RunStatus.is_completed == True).count_async()
+  in_error = RunStatus.query(RunStatus.num_errors > 0).count_async()
+  completed_with_errors = RunStatus.query(
+      RunStatus.num_errors > 0,
+      RunStatus.is_completed == True).count_async()
+  completed_high = RunStatus.query(
+      RunStatus.is_completed == True,
+      RunStatus.high_priority == True).count_async()
+  todo_high = RunStatus.query(
+      RunStatus.active_marker == 'active',
+      RunStatus.high_priority == True).count_async()
   ret = """
     total {} <br>
     running {} <br>
@@ -212,9 +218,11 @@ def GetWorkStatus():
     <hr>
     with_errors {} <br>
     completed_with_errors {} <br>
-  """.format(total.count(), running.count(), completed.count(),
-             todo_high.count(), completed_high.count(), in_error.count(),
-             completed_with_errors.count())
+  """.format(total.get_result(), running.get_result(),
+             completed.get_result(), todo_high.get_result(),
+             completed_high.get_result(), in_error.get_result(),
+             completed_with_errors.get_result())
+  memcache.set(WORK_STATUS_CACHE_KEY, ret, time=WORK_STATUS_CACHE_SECONDS)
   return ret
 
 
@@ -234,36 +242,77 @@ def AddWork():
   parameters.append(float(request.args.get('days', 100)))
   parameters.append(request.args.get('isc_catalog', 'rev'))
   parameters.append(int(request.args.get('priority', 0)))
-  parameters = json.dumps(parameters)
-  if RunStatus.query(RunStatus.parameters == parameters).count():
+  # The entity id is derived deterministically from the canonical JSON of
+  # the parameters, so the duplicate check is a single key lookup instead of
+  # an indexed scan and count over the parameters property.
+  run_id = hashlib.sha1(json.dumps(parameters)).hexdigest()
+  if ndb.Key(RunStatus, run_id).get():
     logging.info('trying to add work that already exists.')
     return 'Trying to add work that already exists.', 400
-  work = RunStatus()
+  work = RunStatus(id=run_id)
   work.SaveParameters(parameters)
   work.put()
+  memcache.delete(WORK_STATUS_CACHE_KEY)
   return GetWorkStatus()
 
 
+@ndb.transactional(retries=3)
+def CheckinRun(key, uuid):
+  """Transactionally checks a run in for a worker.
+
+  The entity is re-fetched inside the transaction, so concurrent workers
+  serialize (and retry) at the datastore layer instead of bouncing
+  collision 500s back over HTTP.
+
+  Args:
+    key: The RunStatus entity id to check in.
+    uuid: The UUID (as a string) of the worker checking in.
+  Returns:
+    The UUID of the worker that owns the run.
+  Raises:
+    RuntimeError: If another live worker owns the run.
+  """
+  logging.info('checking in')
+  run = RunStatus.get_by_id(key)
+  # Check the UUIDs. If they aren't the same, we need to check the time.
+  if run.uuid and uuid != run.uuid:
+    logging.info('uuids don\'t match %s %s', uuid, run.uuid)
+    if run.last_runner_checkin + TIMEOUT > datetime.datetime.now():
+      logging.info(run.last_runner_checkin)
+      raise RuntimeError
+  run.uuid = uuid
+  run.checkin_count += 1
+  run.last_runner_checkin = datetime.datetime.now()
+  run.put()
+  return run.uuid
+
+
 def RequestWork():
   """API for worker threads to request a work packet."""
   # Check for work that's not completed and hasn't been pinged in a while.
-  run = RunStatus.query(RunStatus.is_completed == False,
-                        RunStatus.can_retry == True,
-                        RunStatus.high_priority == True,
-                        RunStatus.last_runner_checkin < datetime.datetime.now()
-                        - TIMEOUT).get()
-  if not run:
-    run = RunStatus.query(RunStatus.is_completed == False,
-                          RunStatus.can_retry == True,
-                          RunStatus.last_runner_checkin <
-                          datetime.datetime.now() - TIMEOUT).get()
-  if not run:
+  # The keys-only fetches walk just the composite indexes declared in
+  # index.yaml; only the winning entity is actually read.
+  cutoff = datetime.datetime.now() - TIMEOUT
+  # Both scans run concurrently as async fetches, so finding work costs one
+  # datastore round-trip; the high-priority result wins when it has one.
+  high_future = RunStatus.query(
+      RunStatus.active_marker == 'active',
+      RunStatus.can_retry == True,
+      RunStatus.high_priority == True,
+      RunStatus.last_runner_checkin < cutoff).fetch_async(1, keys_only=True)
+  any_future = RunStatus.query(
+      RunStatus.active_marker == 'active',
+      RunStatus.can_retry == True,
+      RunStatus.last_runner_checkin < cutoff).fetch_async(1, keys_only=True)
+  keys = high_future.get_result() or any_future.get_result()
+  if not keys:
     return 'Nothing to run', 204
-  logging.info('Work requested. Returning: %d', run.key.id())
+  run = keys[0].get()
+  logging.info('Work requested. Returning: %s', run.key.id())
   try:
-    run.Checkin(request.args.get('uuid'))
+    CheckinRun(run.key.id(), request.args.get('uuid'))
   except:
-    logging.info('Collided on key: %d', run.key.id())
+    logging.info('Collided on key: %s', run.key.id())
     return 'Collision on key, try again', 500
   return json.dumps({
       'id': run.key.id(),
@@ -277,16 +326,15 @@ def Checkin():
   key = GetKey(request.args)
   if not key:
     return 'No valid key specified', 400
-  logging.info('Checking id %s     %d', key, int(key))
-  run = RunStatus.get_by_id(int(key))
+  logging.info('Checking id %s', key)
+  run = RunStatus.get_by_id(key)
   if not run:
     return 'No object found', 404
   try:
-    run.Checkin(request.args.get('uuid'))
+    return CheckinRun(key, request.args.get('uuid'))
   except:
     logging.info('Failed to checkin %s', request.args.get('uuid'))
     return 'Collision on key, try again', 500
-  return run.uuid
 
 
 def GetStatus():
@@ -295,7 +343,7 @@ def GetStatus():
   key = GetKey(request.args)
   if not key:
     return status
-  run = RunStatus.get_by_id(int(key))
+  run = RunStatus.get_by_id(key)
   if not run:
     ret = '<B>Invalid key</b><br>'
   else:
@@ -309,23 +357,21 @@ def ReportError():
   if not key:
     logging.info('no key')
     return 'Must specify key', 400
-  run = RunStatus.get_by_id(int(key))
+  run = RunStatus.get_by_id(key)
   if not run:
-    logging.info('no run %d', key)
+    logging.info('no run %s', key)
     return 'Must specify valid key', 404
   if run.is_completed:
-    logging.info('run was completed but error uploaded %d', key)
+    logging.info('run was completed but error uploaded %s', key)
     return 'Run was already completed??', 400
-  if not request.form.has_key('error'):
+  error = request.form.get('error')
+  if not error:
     logging.info('no stack trace given')
     return 'No stacktrace given in <i>error</i> field.', 400
-  error = request.form['error']
   run.full_errors.append(error)
-  if len(error) > 1500:
-    error = error[:1500]
-  run.errors.append(error)
   run.last_runner_checkin = LONG_TIME_AGO
   run.put()
+  memcache.delete(WORK_STATUS_CACHE_KEY)
   return 'Run {} has {} errors'.format(key, run.num_errors)
 
 
@@ -335,24 +381,27 @@ def UploadResult():
   if not key:
     logging.info('no key')
     return 'Must specify key or id', 400
-  run = RunStatus.get_by_id(int(key))
+  run = RunStatus.get_by_id(key)
   if not run:
     logging.info('no run')
     return 'Must specify valid key', 404
   run.last_runner_checkin = LONG_TIME_AGO
   run.is_completed = True
+  run.active_marker = None
   run.put()
+  memcache.delete(WORK_STATUS_CACHE_KEY)
   return 'Successfully updated image {}'.format(key)
 
 
 def RestartRun(key):
   """Accepts an uploaded result."""
-  run = RunStatus.get_by_id(int(key))
+  run = RunStatus.get_by_id(key)
   if not run:
     logging.info('no run')
     return 'Must specify valid key', 404
   run.Restart()
-  return '{} restarted'.format(int(key))
+  memcache.delete(WORK_STATUS_CACHE_KEY)
+  return '{} restarted'.format(key)
 
 
 def GetCompleted():
@@ -361,22 +410,30 @@ def GetCompleted():
   srcmod = request.args.get('srcmod', None)
   q = None
   if key:  # Get by key/id.
-    q = [RunStatus.get_by_id(int(key))]
+    q = [RunStatus.get_by_id(key)]
   if not q and srcmod:  # Get by srcmod.
-    q = RunStatus.query(RunStatus.parameter_filename == srcmod,
-                        RunStatus.is_completed == True)
+    # Fetch the matching keys, then batch-get the full entities in a single
+    # RPC -- the HTML/JSON rendering below touches every property, so
+    # iterating the query would fault entities in one at a time.
+    keys = RunStatus.query(RunStatus.parameter_filename == srcmod,
+                           RunStatus.is_completed == True).fetch(
+                               keys_only=True)
+    q = ndb.get_multi(keys)
   if not q:  # If no query parameters, just get completed.
+    # Project only the filename (a single-property projection rides the
+    # built-in index; adding the computed URL properties would need a
+    # composite index) and derive the URLs from it here.
     q = RunStatus.query(projection=[RunStatus.parameter_filename],
                         distinct=True)
+    filenames = [run.parameter_filename for run in q]
+    urls = ['/scheduler/completed?srcmod={}'.format(f) for f in filenames]
     if request.args.has_key('json'):
-      return json.dumps([{run.parameter_filename: run.CompletedJSONURL()}
-                         for run in q])
+      return json.dumps([{f: url + '&json'}
+                         for f, url in zip(filenames, urls)])
     return '<BR>'.join([('<B>{}</B> '
                          '<A HREF="{}">RESULTS</A> '
-                         '<A HREF="{}">JSON</A>'.format(run.parameter_filename,
-                                                        run.CompletedURL(),
-                                                        run.CompletedJSONURL()))
-                        for run in q])
+                         '<A HREF="{}">JSON</A>'.format(f, url, url + '&json'))
+                        for f, url in zip(filenames, urls)])
   if request.args.has_key('json'):  # Send JSON data?
     return json.dumps([run.DictStatus() for run in q])
   return '<HR>'.join([run.HTMLStatus() for run in q])
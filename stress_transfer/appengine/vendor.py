@@ -65,6 +65,12 @@ def add(folder, index=1):
   else:
     folder = os.path.join(os.path.dirname(__file__), folder)
 
+  # If the folder is already on the path (eg, a module reload, or several
+  # handlers importing us), there's nothing to do -- rescanning the site dir
+  # and reshuffling sys.path just slows instance startup.
+  if folder in sys.path:
+    return
+
   # Use site.addsitedir() because it appropriately reads .pth
   # files for namespaced packages. Unfortunately, there's not an
   # option to choose where addsitedir() puts its paths in sys.path
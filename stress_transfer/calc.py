@@ -43,12 +43,13 @@ def Cfs(tensors, n_vec_normal, n_vec_in_plane, coefficient_of_friction):
   Returns:
     cfc: a list of Coulomb failure criteria values.
   """
-  cfc = []
-  for tensor in tensors:
-    delta_tau = np.dot(np.dot(tensor, n_vec_normal), n_vec_in_plane)
-    delta_sigma = np.dot(np.dot(tensor, n_vec_normal), n_vec_normal)
-    cfc.append(delta_tau + coefficient_of_friction * delta_sigma)
-  return np.array(cfc)
+  # One batched contraction over the stacked tensors instead of a Python
+  # loop of tiny dot products. The reshape keeps an empty input (no ISC
+  # events survived filtering) a valid (0, 3, 3) stack.
+  tractions = np.dot(np.asarray(tensors).reshape((-1, 3, 3)), n_vec_normal)
+  delta_tau = np.dot(tractions, n_vec_in_plane)
+  delta_sigma = np.dot(tractions, n_vec_normal)
+  return delta_tau + coefficient_of_friction * delta_sigma
 
 
 def CfsNormal(tensors, n_vec_normal, coefficient_of_friction):
@@ -68,11 +69,9 @@ def CfsNormal(tensors, n_vec_normal, coefficient_of_friction):
   Returns:
     cfc: a list of normal only Coulomb failure criteria values.
   """
-  cfc = []
-  for tensor in tensors:
-    delta_sigma = np.dot(np.dot(tensor, n_vec_normal), n_vec_normal)
-    cfc.append(coefficient_of_friction * delta_sigma)
-  return np.array(cfc)
+  tractions = np.dot(np.asarray(tensors).reshape((-1, 3, 3)), n_vec_normal)
+  delta_sigma = np.dot(tractions, n_vec_normal)
+  return coefficient_of_friction * delta_sigma
 
 
 def CfsTotal(tensors, n_vec_normal, n_vec_in_plane, coefficient_of_friction):
@@ -93,15 +92,13 @@ def CfsTotal(tensors, n_vec_normal, n_vec_in_plane, coefficient_of_friction):
   Returns:
     cfc: a list of total Coulomb failure criteria values.
   """
-  cfc = []
   n_vec_cross = np.cross(n_vec_normal, n_vec_in_plane)
-  for tensor in tensors:
-    delta_tau1 = np.dot(np.dot(tensor, n_vec_normal), n_vec_in_plane)
-    delta_tau2 = np.dot(np.dot(tensor, n_vec_normal), n_vec_cross)
-    delta_sigma = np.dot(np.dot(tensor, n_vec_normal), n_vec_normal)
-    cfc.append(np.abs(delta_tau1) + np.abs(delta_tau2)
-               + coefficient_of_friction * delta_sigma)
-  return np.array(cfc)
+  tractions = np.dot(np.asarray(tensors).reshape((-1, 3, 3)), n_vec_normal)
+  delta_tau1 = np.dot(tractions, n_vec_in_plane)
+  delta_tau2 = np.dot(tractions, n_vec_cross)
+  delta_sigma = np.dot(tractions, n_vec_normal)
+  return (np.abs(delta_tau1) + np.abs(delta_tau2)
+          + coefficient_of_friction * delta_sigma)
 
 
 def MaximumShear(tensors):
@@ -116,11 +113,35 @@ def MaximumShear(tensors):
   Returns:
     ret: a list of maximum shear values.
   """
-  ret = []
-  for tensor in tensors:
-    eigen_values = list(np.linalg.eigvalsh(tensor))
-    ret.append((max(eigen_values) - min(eigen_values)) / 2.0)
-  return np.array(ret)
+  # Closed-form eigenvalues for symmetric 3x3 tensors (Smith's trigonometric
+  # solution), broadcast over the whole stack -- one LAPACK call per tensor
+  # costs far more than the 3x3's worth of arithmetic.
+  tensors = np.asarray(tensors).reshape((-1, 3, 3))
+  a00 = tensors[:, 0, 0]
+  a11 = tensors[:, 1, 1]
+  a22 = tensors[:, 2, 2]
+  a01 = tensors[:, 0, 1]
+  a02 = tensors[:, 0, 2]
+  a12 = tensors[:, 1, 2]
+
+  q = (a00 + a11 + a22) / 3.0
+  b00 = a00 - q
+  b11 = a11 - q
+  b22 = a22 - q
+  p1 = a01 ** 2 + a02 ** 2 + a12 ** 2
+  p2 = b00 ** 2 + b11 ** 2 + b22 ** 2 + 2.0 * p1
+  # Guard the isotropic case (p2 == 0): all eigenvalues equal q, so the
+  # maximum shear is zero; the placeholder p keeps the division finite.
+  p = np.sqrt(p2 / 6.0)
+  p_safe = np.where(p2 > 0, p, 1.0)
+  det_b = (b00 * (b11 * b22 - a12 ** 2) -
+           a01 * (a01 * b22 - a12 * a02) +
+           a02 * (a01 * a12 - b11 * a02))
+  r = np.clip(det_b / (2.0 * p_safe ** 3), -1.0, 1.0)
+  phi = np.arccos(r) / 3.0
+  eig_max = q + 2.0 * p * np.cos(phi)
+  eig_min = q + 2.0 * p * np.cos(phi + 2.0 * np.pi / 3.0)
+  return np.where(p2 > 0, (eig_max - eig_min) / 2.0, 0.0)
 
 
 def TensorInvariants(tensors):
@@ -136,16 +157,69 @@ def TensorInvariants(tensors):
   Returns:
     Three lists (i1, i2, i3) of numpy arrays.
   """
-  i1 = []
-  i2 = []
-  i3 = []
-  for tensor in tensors:
-    i1.append(np.trace(tensor))
-    i2.append(np.linalg.det(tensor[0:2, 0:2]) +
-              np.linalg.det(tensor[1:3, 0:2]) +
-              np.linalg.det(tensor[1:3, 1:3]))
-    i3.append(np.linalg.det(tensor))
-  return np.array(i1), np.array(i2), np.array(i3)
+  # Expanded minors over the whole (N, 3, 3) stack; per-tensor np.linalg.det
+  # calls cost orders of magnitude more than the handful of FLOPs involved.
+  tensors = np.asarray(tensors).reshape((-1, 3, 3))
+  i1 = tensors[:, 0, 0] + tensors[:, 1, 1] + tensors[:, 2, 2]
+  i2 = (tensors[:, 0, 0] * tensors[:, 1, 1] -
+        tensors[:, 0, 1] * tensors[:, 1, 0] +
+        tensors[:, 1, 0] * tensors[:, 2, 1] -
+        tensors[:, 1, 1] * tensors[:, 2, 0] +
+        tensors[:, 1, 1] * tensors[:, 2, 2] -
+        tensors[:, 1, 2] * tensors[:, 2, 1])
+  i3 = (tensors[:, 0, 0] * (tensors[:, 1, 1] * tensors[:, 2, 2] -
+                            tensors[:, 1, 2] * tensors[:, 2, 1]) -
+        tensors[:, 0, 1] * (tensors[:, 1, 0] * tensors[:, 2, 2] -
+                            tensors[:, 1, 2] * tensors[:, 2, 0]) +
+        tensors[:, 0, 2] * (tensors[:, 1, 0] * tensors[:, 2, 1] -
+                            tensors[:, 1, 1] * tensors[:, 2, 0]))
+  return i1, i2, i3
+
+
+def AllCriteria(tensors, n_vec_normal, n_vec_in_plane, coefficient_of_friction):
+  """Calculate all the failure criteria for a stack of tensors in one pass.
+
+  Computes the same scalar fields as Cfs, CfsTotal, CfsNormal, MaximumShear,
+  and TensorInvariants, but over a single stacked (N, 3, 3) array so that the
+  tensors are swept once instead of once per criterion.
+
+  Args:
+    tensors: A list (or (N, 3, 3) array) of symmetric 3x3 arrays.
+    n_vec_normal: a 3-element unit vector normal to the receiver fault plane
+    n_vec_in_plane: a 3-element unit vector in the direction of preferred slip
+    coefficient_of_friction: scalar, coefficient of friction
+        (0-0.85, typically)
+
+  Returns:
+    Dictionary mapping criterion name suffixes (eg, '_cfs', '_i0',
+    '_max_shear') to length-N numpy arrays.
+  """
+  tensors = np.asarray(tensors).reshape((-1, 3, 3))
+  n_vec_cross = np.cross(n_vec_normal, n_vec_in_plane)
+
+  # Tractions on the receiver plane; every Coulomb flavor is built from these.
+  tractions = np.dot(tensors, n_vec_normal)
+  delta_tau = np.dot(tractions, n_vec_in_plane)
+  delta_tau_cross = np.dot(tractions, n_vec_cross)
+  delta_sigma = np.dot(tractions, n_vec_normal)
+  friction_sigma = coefficient_of_friction * delta_sigma
+  total_shear = np.abs(delta_tau) + np.abs(delta_tau_cross)
+
+  # Invariants following Malvern (1969); TensorInvariants is already fully
+  # vectorized, so just share it.
+  i1, i2, i3 = TensorInvariants(tensors)
+
+  return {
+      '_cfs': delta_tau + friction_sigma,
+      '_cfs_shear_only': delta_tau,
+      '_i0': i1,
+      '_i1': i2,
+      '_i2': i3,
+      '_max_shear': MaximumShear(tensors),
+      '_cfs_total': total_shear + friction_sigma,
+      '_cfs_total_shear_only': total_shear,
+      '_cfs_normal': friction_sigma,
+  }
 
 
 def DeviatoricTensor(tensors):
@@ -162,8 +236,13 @@ def DeviatoricTensor(tensors):
   Returns:
     A list of 3x3 arrays with the isotropic component subtracted out.
   """
-  ret = []
-  for tensor in tensors:
-    avg = np.trace(tensor) / 3.
-    ret.append(tensor - avg * np.eye(3))
-  return np.array(ret)
+  # Broadcast over the whole stack: copy once, then subtract the isotropic
+  # average straight off the three diagonals -- no per-tensor identity
+  # matrices or list appends.
+  tensors = np.asarray(tensors).reshape((-1, 3, 3))
+  avg = (tensors[:, 0, 0] + tensors[:, 1, 1] + tensors[:, 2, 2]) / 3.
+  ret = tensors.copy()
+  ret[:, 0, 0] -= avg
+  ret[:, 1, 1] -= avg
+  ret[:, 2, 2] -= avg
+  return ret
@@ -19,8 +19,15 @@
 """Simple that runs the Coloumb Stress code."""
 
 import cStringIO
-import json
+import gzip
+try:
+  # ujson is a C drop-in for the decode calls we make; fall back to the
+  # stdlib decoder when it isn't installed.
+  import ujson as json
+except ImportError:
+  import json
 import logging
+import multiprocessing
 from optparse import OptionParser
 import os
 import pickle
@@ -38,8 +45,12 @@ BUCKET = 'clouddfe-cfs'
 SRCMOD = 'gs://{}/srcmod'.format(BUCKET)
 UUID = str(uuid.uuid1())
 
-# Should the status thread run?
-should_status = True
+# Shared HTTP session. Keep-alive lets every scheduler request reuse one TCP
+# connection rather than paying connection setup per checkin/report.
+SESSION = requests.Session()
+
+# Set this event to stop the status thread.
+stop_status = threading.Event()
 
 # Set up command line parser.
 parser = OptionParser()
@@ -81,22 +92,24 @@ def RequestWork(host, retries=10):
   """
   url = host + '/scheduler/request_work'
   logging.info('Requesting work %s', url)
+  attempt = 0
   while True:
     if retries < 0:
       logging.info('Ran out of retries.')
       return None
-    response = requests.get(url, params={'uuid': UUID})
+    response = SESSION.get(url, params={'uuid': UUID})
     if response.status_code != requests.codes.ok:
-      time.sleep(5)  # backoff a little bit.
       logging.info('Error: %d', response.status_code)
       retries -= 1
+      attempt += 1
+      time.sleep(min(60, 2 ** attempt))  # Exponential backoff.
       continue
     ret = json.loads(response.text)
-    time.sleep(5)  # back off a little bit
-    if not Checkin(ret['id']):
-      time.sleep(5)  # back off a little bit
+    if not Checkin(host, ret['id']):
       logging.info('Checkin failed')
       retries -= 1
+      attempt += 1
+      time.sleep(min(60, 2 ** attempt))  # Exponential backoff.
       continue
     break
   logging.info('Work receivced "%s"', response.text)
@@ -111,10 +124,10 @@ def ReportResults(host, key):
     key: What key to send results to.
   """
   url = host + '/scheduler/upload'
-  logging.info('Sending (%d) results %s', key, url)
-  r = requests.post(url, params={'key': key})
+  logging.info('Sending (%s) results %s', key, url)
+  r = SESSION.post(url, params={'key': key})
   if r.status_code != requests.codes.ok:
-    logging.error('Error %d sending results for work %d', r.status_code, key)
+    logging.error('Error %d sending results for work %s', r.status_code, key)
     return
   logging.info('successfully uploaded %s', key)
 
@@ -128,24 +141,25 @@ def ReportError(host, key, error):
     error: Error string (stack trace) to report.
   """
   url = host + '/scheduler/error'
-  r = requests.post(url, data={'error': error}, params={'key': key})
+  r = SESSION.post(url, data={'error': error}, params={'key': key})
   if r.status_code != requests.codes.ok:
     logging.error('Error (%d) reporting error\n %s', r.status_code, error)
     return
-  logging.info('Error reported for key(%d)', key)
+  logging.info('Error reported for key(%s)', key)
 
 
-def Checkin(key):
+def Checkin(host, key):
   """Checkin once.
 
   Args:
+    host: The host to connect to.
     key: The UUID (as a String) of the run we're checking in.
 
   Returns:
     True/False if the checkin was successful.
   """
   url = host + '/scheduler/checkin'
-  r = requests.get(url, params={'key': key, 'uuid': UUID})
+  r = SESSION.get(url, params={'key': key, 'uuid': UUID})
   if r.status_code != requests.codes.ok:
     return False
   return r.text == UUID
@@ -157,113 +171,138 @@ def ReportStatus(host, key, interval):
 
   Continuously pings the server saying, "this UUID is alive and still
   processing," so that the work packet doesn't get scheduled with a different
-  worker. To kill this thread, set the global "should_status" to False.
+  worker. To kill this thread, set the global "stop_status" event.
 
   Args:
     host: The host to connect to.
     key: The UUID (as a string) for which we should ping as "alive".
     interval: Time in seconds between pings.
   """
-  global should_status
   logging.info('Starting ping thread')
-  while should_status:
-    logging.info('Pinging server for id %d', key)
+  while not stop_status.is_set():
+    logging.info('Pinging server for id %s', key)
     if not Checkin(host, key):
       logging.info('Failed to checkin.')
       return
-    for _ in range(interval):
-      time.sleep(1)
-      if not should_status:
-        return
-  logging.info('DONE pinging server for id %d', key)
-
+    # Waiting on the event (rather than a 1-second poll loop) means shutdown
+    # is immediate and the thread sleeps untouched between pings.
+    if stop_status.wait(interval):
+      break
+  logging.info('DONE pinging server for id %s', key)
 
-def main(_=None):
-  global should_status
 
-  # Parse the command line options.
-  (options, _) = parser.parse_args()
-  run_local = (options.parameters is not None)
-  if not run_local:
-    # Start '-jobs' works -- each in a different process so they get their own
-    # CPU, memory space, etc.
-    for i in range(1, int(options.jobs)):
-      if os.fork():
-        logging.info('Spawned job %d', i)
-      else:  # In child.
-        break
+def ProcessWork(host, work, run_local=False):
+  """Processes a single work packet, uploading its results to the cloud.
 
-  while True:
-    # If we're a local run, we have the parameters. Format them like we got them
-    # from appengine. Otherwise, we grab our work packet from the web.
-    if run_local:
-      logging.info('Running locally %s', options.parameters)
-      work = {
-          'id': options.id,
-          'parameters': options.parameters,
-      }
+  Args:
+    host: The scheduler host to report status/results to.
+    work: Dictionary with the work packet's 'id' and 'parameters'.
+    run_local: If True, skip all of the scheduler status reporting.
+  """
+  status_thread = None
+  try:
+    key = work['id']
+
+    if not run_local:
+      # Start pinging the server.
+      stop_status.clear()
+      status_thread = threading.Thread(target=ReportStatus,
+                                       args=(host, key, 240))
+      status_thread.start()
+
+    # Get everything into place for processing.
+    logging.info('starting quake')
+    logging.info(work)
+    parameters = work['parameters']
+    if not isinstance(parameters, list):
+      # Local runs pass the parameters as a JSON string on the command line;
+      # the scheduler now sends them structured.
+      parameters = json.loads(parameters)
+    results_filename = GetResultFileNameOnCloud(parameters)
+    image_filename = GetImageFileNameOnCloud(parameters)
+    parameters[0] = os.path.join(SRCMOD, parameters[0])
+
+    # Run the quake.
+    criteria, graph = process.ModelQuake(*parameters[:8])
+
+    logging.info('done quake')
+
+    # Output the data.
+    if graph:  # If we have graph data, send it to the cloud.
+      gcs.Write(image_filename, graph, suffix='.png')
     else:
-      # Grab work packet from the web.
-      work = RequestWork(options.host)
+      logging.error('******** No graph generated!!!!!!!!!')
+
+    # Write the CFS data. The binary pickle protocol is several times
+    # smaller and faster than the default text protocol for the
+    # numpy-heavy criteria dict, and gzipping the pickle typically
+    # shrinks it several times more, so the upload moves far fewer
+    # bytes. Read results back with gzip.open/pickle.load.
+    logging.info('size: %d', sys.getsizeof(criteria))
+
+    def _WriteResults(stream):
+      """Gzip-pickles the criteria straight into the upload buffer."""
+      with gzip.GzipFile(fileobj=stream, mode='wb') as zipped:
+        pickle.dump(criteria, zipped, protocol=pickle.HIGHEST_PROTOCOL)
+    gcs.WriteStream(results_filename, _WriteResults, suffix='.gz')
+    if not run_local:
+      ReportResults(host, key)
+
+  except:
+    # Uh-oh. We've had an exception. Capture it, and report it.
+    logging.info('Fatal error, stopping run')
+    f = cStringIO.StringIO()
+    traceback.print_exc(file=f)
+    stack = f.getvalue()
+    if not run_local:
+      ReportError(host, key, stack)
+    logging.error('EXCEPTION. Stack trace\n%s', stack)
+
+  finally:
+    # Stop pinging the server.
+    logging.info('stopping reporter')
+    stop_status.set()
+    if status_thread:
+      status_thread.join()
+
+
+def _WorkerLoop(host):
+  """Pulls and processes work packets from the scheduler until it runs dry."""
+  while True:
+    work = RequestWork(host)
     if not work:
       logging.info('No Work')
-      break
-    try:
-      key = work['id']
-
-      if not run_local:
-        # Start pinging the server.
-        should_status = True
-        status_thread = threading.Thread(target=ReportStatus,
-                                         args=(options.host, key, 240))
-        status_thread.start()
-
-      # Get everything into place for processing.
-      logging.info('starting quake')
-      logging.info(work)
-      parameters = json.loads(work['parameters'])
-      results_filename = GetResultFileNameOnCloud(parameters)
-      image_filename = GetImageFileNameOnCloud(parameters)
-      parameters[0] = os.path.join(SRCMOD, parameters[0])
-
-      # Run the quake.
-      criteria, graph = process.ModelQuake(*parameters[:8])
-
-      logging.info('done quake')
-
-      # Output the data.
-      if graph:  # If we have graph data, send it to the cloud.
-        gcs.Write(image_filename, graph, suffix='.png')
-      else:
-        logging.error('******** No graph generated!!!!!!!!!')
-
-      # Write the CFS data.
-      logging.info('size: %d', sys.getsizeof(criteria))
-      gcs.Write(results_filename, pickle.dumps(criteria))
-      if not run_local:
-        ReportResults(options.host, key)
-
-    except:
-      # Uh-oh. We've had an exception. Capture it, and report it.
-      logging.info('Fatal error, stopping run')
-      f = cStringIO.StringIO()
-      traceback.print_exc(file=f)
-      stack = f.getvalue()
-      if not run_local:
-        ReportError(options.host, key, stack)
-      logging.error('EXCEPTION. Stack trace\n%s', stack)
-
-    finally:
-      # Stop pinging the server.
-      logging.info('stopping reporter')
-      should_status = False
-      if not run_local and status_thread:
-        status_thread.join()
-
-    # If we're a local run, break out.
-    if run_local: break
-
+      return
+    ProcessWork(host, work)
     logging.info('Done work')
+
+
+def main(_=None):
+  # Parse the command line options.
+  (options, _) = parser.parse_args()
+  if options.parameters is not None:
+    # If we're a local run, we have the parameters. Format them like we got
+    # them from appengine.
+    logging.info('Running locally %s', options.parameters)
+    work = {
+        'id': options.id,
+        'parameters': options.parameters,
+    }
+    ProcessWork(options.host, work, run_local=True)
+  else:
+    # Start '--jobs' workers, each in its own process so they get their own
+    # CPU and memory space. Each worker only pulls a packet from the
+    # scheduler when it's free, so no work is checked out before a CPU is
+    # ready for it. These must be plain (non-daemonic) Processes, not a
+    # Pool: pool workers are daemonic and can't spawn the children that
+    # CalcOkada's own worker pool needs.
+    workers = [multiprocessing.Process(target=_WorkerLoop,
+                                       args=(options.host,))
+               for _ in range(int(options.jobs))]
+    for worker in workers:
+      worker.start()
+    for worker in workers:
+      worker.join()
   logging.info('SHUTTING DOWN')
 
 
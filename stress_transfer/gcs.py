@@ -20,23 +20,41 @@
 
 import io
 import logging
-import os
-import StringIO
-import tempfile
+import mimetypes
+import threading
 
 from apiclient import discovery
 from apiclient.errors import HttpError
 from apiclient.http import MediaIoBaseDownload
+from apiclient.http import MediaIoBaseUpload
 import httplib2
 from oauth2client.client import GoogleCredentials
 
 
-# Size of the data to download from GCE at a chunk.
-CHUNK_SIZE = 2 * 1024 * 1024
+# Size of the data to download from GCE at a chunk. Large enough that typical
+# ISC/SRCMOD files come down in a single range request instead of paying a
+# round trip per 2 MiB.
+CHUNK_SIZE = 64 * 1024 * 1024
 
 # Retry transport and file IO errors.
 RETRYABLE_ERRORS = (httplib2.HttpLib2Error, IOError)
 
+# Per-thread cache of the storage service client. Building one fetches and
+# parses the API discovery document over HTTP, so pay that once per thread
+# instead of once per File/Write call. (Per thread, not per process, because
+# the underlying httplib2 connection isn't safe to share across threads.)
+_local = threading.local()
+
+
+def _GetService():
+  """Returns this thread's (lazily built) cloud storage service client."""
+  service = getattr(_local, 'service', None)
+  if service is None:
+    credentials = GoogleCredentials.get_application_default()
+    service = discovery.build('storage', 'v1', credentials=credentials)
+    _local.service = service
+  return service
+
 
 def File(gs_path, chunk_size=CHUNK_SIZE):
   """Download a file from the cloud, and return a file that's readable.
@@ -51,10 +69,11 @@ def File(gs_path, chunk_size=CHUNK_SIZE):
   bucket_name, object_name = gs_path[5:].split('/', 1)
   logging.info('Downloading file: %s/%s', bucket_name, object_name)
 
-  credentials = GoogleCredentials.get_application_default()
-  service = discovery.build('storage', 'v1', credentials=credentials)
+  service = _GetService()
   request = service.objects().get_media(bucket=bucket_name, object=object_name)
-  output = StringIO.StringIO()
+  # Download straight into the BytesIO we hand back; going through an
+  # intermediate buffer plus getvalue() copied the whole file a second time.
+  output = io.BytesIO()
   media = MediaIoBaseDownload(output, request, chunksize=chunk_size)
   done = False
   while not done:
@@ -66,27 +85,47 @@ def File(gs_path, chunk_size=CHUNK_SIZE):
     except RETRYABLE_ERRORS, err:
       pass
   logging.info('Downloaded file: %s/%s', bucket_name, object_name)
-  return io.BytesIO(output.getvalue())
+  output.seek(0)
+  return output
 
 
-def Write(gs_path, data, suffix='.txt'):
-  """Writes data to the cloud."""
-  credentials = GoogleCredentials.get_application_default()
-  service = discovery.build('storage', 'v1', credentials=credentials)
+def _Upload(gs_path, stream, suffix):
+  """Uploads the contents of a file-like object to the cloud."""
+  service = _GetService()
 
   bucket_name, object_name = gs_path[5:].split('/', 1)
   logging.info('Uploading file: %s/%s', bucket_name, object_name)
 
-  # Save the data off into a temp file.
-  tfile = tempfile.NamedTemporaryFile(delete=False, suffix=suffix)
-  tfile.write(data)
-  tfile.close()
-
-  # Upload the data.
-  logging.info('filename: %s   %s     %s', tfile.name, object_name, bucket_name)
-  req = service.objects().insert(media_body=tfile.name, name=object_name,
+  # Upload straight from memory. The old flow wrote the payload into a temp
+  # file just so the API client could read it back off disk -- two extra
+  # copies (and an fsync) of a potentially hundreds-of-MB pickle.
+  mimetype = (mimetypes.guess_type('file' + suffix)[0] or
+              'application/octet-stream')
+  media = MediaIoBaseUpload(stream, mimetype=mimetype)
+  req = service.objects().insert(media_body=media, name=object_name,
                                  bucket=bucket_name)
   _ = req.execute()
 
-  # Cleanup.
-  os.remove(tfile.name)
+
+def Write(gs_path, data, suffix='.txt'):
+  """Writes data to the cloud."""
+  _Upload(gs_path, io.BytesIO(data), suffix)
+
+
+def WriteStream(gs_path, writer_fn, suffix='.txt'):
+  """Writes data produced by a writer function to the cloud.
+
+  The writer builds its payload directly in the upload buffer, so unlike
+  Write, the caller never has to materialize (and copy) the full payload as
+  a bytes object first.
+
+  Args:
+    gs_path: Fully qualified gcs path of the object to write.
+    writer_fn: Called with a writable file object; whatever it writes is
+      uploaded.
+    suffix: Filename suffix, used to guess the upload's mimetype.
+  """
+  stream = io.BytesIO()
+  writer_fn(stream)
+  stream.seek(0)
+  _Upload(gs_path, stream, suffix)
@@ -26,6 +26,7 @@ import cStringIO
 import matplotlib
 matplotlib.use('Agg')
 from matplotlib import cm
+from matplotlib.collections import LineCollection
 import matplotlib.pyplot as plt
 import numpy as np
 
@@ -79,15 +80,12 @@ def PlotSrcmodStressAndEarthquakesBuffer(event_srcmod, x_vec, y_vec, cfs,
   cfs['cfsUpperLimit'] = 1e5  # For visualziation purposes.
   cfs['cfsLowerLimit'] = -1e5  # For visualization purposes.
 
+  # Clip the field to the visualization limits in one pass. The limits
+  # straddle zero, so the old separate "> 0" / "< 0" index intersections
+  # were subsumed by the clip.
   cfs['cfsRaw'] = cfs['cfs'].copy()
-  high_1 = (cfs['cfs'] > cfs['cfsUpperLimit']).nonzero()
-  high_2 = (cfs['cfs'] > 0).nonzero()
-  high_indices = np.intersect1d(np.array(high_1), np.array(high_2))
-  low_1 = (cfs['cfs'] < cfs['cfsLowerLimit']).nonzero()
-  low_2 = (cfs['cfs'] < 0).nonzero()
-  low_indices = np.intersect1d(np.array(low_1), np.array(low_2))
-  cfs['cfs'][high_indices] = cfs['cfsUpperLimit']
-  cfs['cfs'][low_indices] = cfs['cfsLowerLimit']
+  np.clip(cfs['cfs'], cfs['cfsLowerLimit'], cfs['cfsUpperLimit'],
+          out=cfs['cfs'])
 
   # Generate figure showing fault geometry and CFS field.
   fig = plt.figure(facecolor='white', figsize=(fig_width, fig_height),
@@ -96,12 +94,15 @@ def PlotSrcmodStressAndEarthquakesBuffer(event_srcmod, x_vec, y_vec, cfs,
   ax = fig.gca()
   # Both of these contouring calls are plotting (erronously) in some concave
   # regions for some reason???
-  plt.tricontourf(x_vec.flatten(), y_vec.flatten(),
-                  pascals_to_megapascals * cfs['cfs'].flatten(),
+  # Flatten and rescale the contour inputs once for both calls -- and with
+  # ravel, which returns a view where flatten always copies.
+  x_flat = x_vec.ravel()
+  y_flat = y_vec.ravel()
+  cfs_megapascals = pascals_to_megapascals * cfs['cfs'].ravel()
+  plt.tricontourf(x_flat, y_flat, cfs_megapascals,
                   n_contours, cmap=cm.bwr,
                   origin='lower', hold='on', extend='both')
-  plt.tricontour(x_vec.flatten(), y_vec.flatten(),
-                 pascals_to_megapascals * cfs['cfs'].flatten(), zero_contour,
+  plt.tricontour(x_flat, y_flat, cfs_megapascals, zero_contour,
                  linewidths=line_width,
                  colors='w', origin='lower', hold='on')
 
@@ -115,26 +116,33 @@ def PlotSrcmodStressAndEarthquakesBuffer(event_srcmod, x_vec, y_vec, cfs,
             markerfacecoloralt='gray',
             markersize=marker_size, alpha=opacity)
 
-  # Plot the edges of each fault patch.
-  for i in range(len(event_srcmod['x1'])):
-    ax.plot([event_srcmod['x1Utm'][i], event_srcmod['x2Utm'][i]],
-            [event_srcmod['y1Utm'][i], event_srcmod['y2Utm'][i]],
-            color=fault_color, linewidth=line_width)
-    ax.plot([event_srcmod['x2Utm'][i], event_srcmod['x4Utm'][i]],
-            [event_srcmod['y2Utm'][i], event_srcmod['y4Utm'][i]],
-            color=fault_color, linewidth=line_width)
-    ax.plot([event_srcmod['x1Utm'][i], event_srcmod['x3Utm'][i]],
-            [event_srcmod['y1Utm'][i], event_srcmod['y3Utm'][i]],
-            color=fault_color, linewidth=line_width)
-    ax.plot([event_srcmod['x3Utm'][i], event_srcmod['x4Utm'][i]],
-            [event_srcmod['y3Utm'][i], event_srcmod['y4Utm'][i]],
-            color=fault_color, linewidth=line_width)
+  # Plot the edges of each fault patch -- all four edges of every patch go
+  # into one LineCollection, so matplotlib draws a single artist instead of
+  # 4N separate Line2D objects.
+  edges = []
+  for corner_a, corner_b in [('1', '2'), ('2', '4'), ('1', '3'), ('3', '4')]:
+    endpoints = np.array([[event_srcmod['x' + corner_a + 'Utm'],
+                           event_srcmod['y' + corner_a + 'Utm']],
+                          [event_srcmod['x' + corner_b + 'Utm'],
+                           event_srcmod['y' + corner_b + 'Utm']]])
+    edges.append(endpoints.transpose(2, 0, 1))  # To (num_patches, 2, 2).
+  ax.add_collection(LineCollection(np.concatenate(edges),
+                                   colors=fault_color,
+                                   linewidths=line_width))
 
   # Standard decorations.
   plt.title(event_srcmod['tag'])
   plt.axis('equal')
   plt.axis('off')
 
+  # Scatter data shared by the three per-event panels. One PathCollection
+  # per panel replaces a Line2D artist per event, which dominated both the
+  # render time and the PNG size for large catalogs.
+  field_mp = pascals_to_megapascals * np.asarray(field)
+  event_colors = np.where(field_mp > 0, 'red', 'blue')
+  positives = int((field_mp > 0).sum())
+  negatives = field_mp.size - positives
+
   # FC as a function of distance from SRCMOD epicenter
   plt.subplot(3, 2, 2)
   ax = fig.gca()
@@ -142,20 +150,9 @@ def PlotSrcmodStressAndEarthquakesBuffer(event_srcmod, x_vec, y_vec, cfs,
           [y_level_horizontal_line, y_level_horizontal_line],
           marker=' ', color='k', linestyle='-',
           alpha=opacity)
-  positives = 0
-  negatives = 0
-  for i in range(len(catalog['xUtm'])):
-    if field[i] > 0:
-      positives += 1
-      color = 'red'
-    else:
-      negatives += 1
-      color = 'blue'
-    ax.plot(np.log10(catalog['distanceToEpicenter'][i]),
-            pascals_to_megapascals * field[i], marker='o', color=color,
-            markeredgecolor='none', markerfacecoloralt='gray',
-            markersize=marker_size,
-            alpha=opacity)
+  ax.scatter(np.log10(np.asarray(catalog['distanceToEpicenter'])), field_mp,
+             c=event_colors, s=marker_size ** 2, edgecolors='none',
+             alpha=opacity)
   ax.set_xlim([np.log10(min_d), np.log10(max_d)])
   ax.set_ylim([min_cfs, max_cfs])
   plt.xlabel(r'$\log_{10}\,d \, \mathrm{(m)}$')
@@ -170,12 +167,10 @@ def PlotSrcmodStressAndEarthquakesBuffer(event_srcmod, x_vec, y_vec, cfs,
           [y_level_horizontal_line, y_level_horizontal_line],
           marker=' ', color='k', linestyle='-',
           alpha=opacity)
-  for i in range(len(catalog['xUtm'])):
-    color = 'red' if (field[i] > 0) else 'blue'
-    ax.plot((catalog['datetime'][i] - event_srcmod['datetime']).days,
-            pascals_to_megapascals * field[i], marker='o', color=color,
-            markeredgecolor='none', markerfacecoloralt='gray',
-            markersize=marker_size, alpha=opacity)
+  days_since_event = np.array([(d - event_srcmod['datetime']).days
+                               for d in catalog['datetime']])
+  ax.scatter(days_since_event, field_mp, c=event_colors, s=marker_size ** 2,
+             edgecolors='none', alpha=opacity)
   ax.set_ylim([-0.5e2, 0.5e2])
   ax.set_ylim([min_cfs, max_cfs])
   plt.xlabel(r'$t \, \mathrm{(days)}$')
@@ -188,17 +183,8 @@ def PlotSrcmodStressAndEarthquakesBuffer(event_srcmod, x_vec, y_vec, cfs,
           [y_level_horizontal_line, y_level_horizontal_line],
           marker=' ', color='k', linestyle='-',
           alpha=opacity)
-  for i in range(len(catalog['xUtm'])):
-    if field[i] > 0:
-      ax.plot(catalog['magnitude'][i],
-              pascals_to_megapascals * field[i], marker='o',
-              color='red', markeredgecolor='none', markerfacecoloralt='gray',
-              markersize=marker_size, alpha=opacity)
-    else:
-      ax.plot(catalog['magnitude'][i],
-              pascals_to_megapascals * field[i], marker='o',
-              color='blue', markeredgecolor='none', markerfacecoloralt='gray',
-              markersize=marker_size, alpha=opacity)
+  ax.scatter(np.asarray(catalog['magnitude']), field_mp, c=event_colors,
+             s=marker_size ** 2, edgecolors='none', alpha=opacity)
   ax.set_xlim([min_mag, max_mag])
   ax.set_ylim([min_cfs, max_cfs])
   plt.xlabel(r'$\mathrm{M_W}$')
@@ -207,7 +193,9 @@ def PlotSrcmodStressAndEarthquakesBuffer(event_srcmod, x_vec, y_vec, cfs,
   # Adjust subplot spacing, render, and save
   plt.subplots_adjust(left=None, bottom=None, right=None, top=None, wspace=None,
                       hspace=vertical_subplot_spacing)
-  plt.show()
   stream = cStringIO.StringIO()
-  plt.savefig(stream, format='png')
+  fig.savefig(stream, format='png')
+  # Workers render one of these per run; close the figure so the Agg canvas
+  # and artists don't accumulate across a long-lived process.
+  plt.close(fig)
   return stream.getvalue()
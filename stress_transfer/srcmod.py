@@ -46,8 +46,11 @@ TAGS_RE = re.compile(r'(\w+\s*:\s*(?:\S+ ?)+)')
 FIELDS_RE = re.compile(r'\w+\s+=\s+\-?\d+\.?\d*[eE]?[\+\-]?\d*')
 # DATES are of the form: 'nn/nn/nn'
 DATE_RE = re.compile(r'\d+/\d+/\d+')
-# DATA fields within a segment begin with '% LAT LON'
-DATA_FIELDS_RE = re.compile(r'%\s+LAT\s+LON')
+# The header line naming a segment's data columns begins with '% LAT LON'.
+DATA_FIELDS_RE = re.compile(r'(?m)^%\s+LAT\s+LON.*$')
+# A numeric data line within a segment: one whose first non-whitespace
+# character isn't the '%' comment marker.
+NUMERIC_LINE_RE = re.compile(r'(?m)^[ \t]*[^%\s].*$')
 
 # Maps tags between what's given in the srcmod file, and the output fields we
 # use.
@@ -73,6 +76,26 @@ FIELD_MAP = [
 KM2M = 1e3  # Convert kilometers to meters
 CM2M = 1e-2  # Convert centimeters to meters
 
+# The numeric per-patch fields accumulated by ReadSrcmodFile. These are
+# converted from Python lists to contiguous float64 arrays before the srcmod
+# data is returned, so the hot loops downstream (CalcOkada and friends) index
+# unboxed scalars and can grab whole columns without copies.
+PATCH_FIELDS = [
+    'x1', 'y1', 'z1',
+    'x2', 'y2', 'z2',
+    'x3', 'y3', 'z3',
+    'x4', 'y4', 'z4',
+    'x1Utm', 'y1Utm', 'z1Utm',
+    'x2Utm', 'y2Utm', 'z2Utm',
+    'x3Utm', 'y3Utm', 'z3Utm',
+    'x4Utm', 'y4Utm', 'z4Utm',
+    'patchXUtm', 'patchYUtm',
+    'patchLongitude', 'patchLatitude',
+    'dip', 'strike', 'rake', 'angle',
+    'width', 'length',
+    'slip', 'slipStrike', 'slipDip',
+]
+
 
 def _FindFields(data, opt_ignore_duplicate=True):
   """Finds all 'FIELD = VAL' in given string.
@@ -138,13 +161,25 @@ def _SeparateSegments(num_segments, fields, data):
   # Set up the segment data.
   if num_segments > 1:
     delimeter = '% SEGMENT'
-    assert delimeter in data
-    segments = [delimeter + _ for _ in data.split(delimeter)[1:]]
-    segment_fields = [_FindFields(seg) for seg in segments]
   else:
     delimeter = '% SOURCE MODEL PARAMETERS'
-    assert delimeter in data
-    segments = [delimeter + _ for _ in data.split(delimeter)[1:]]
+  assert delimeter in data
+
+  # Slice the segments out by delimiter offset. Splitting instead would copy
+  # every tail into a new string just so the delimiter could be glued back
+  # onto the front of each piece.
+  offsets = []
+  start = data.find(delimeter)
+  while start >= 0:
+    offsets.append(start)
+    start = data.find(delimeter, start + len(delimeter))
+  offsets.append(len(data))
+  segments = [data[offsets[k]:offsets[k + 1]]
+              for k in range(len(offsets) - 1)]
+
+  if num_segments > 1:
+    segment_fields = [_FindFields(seg) for seg in segments]
+  else:
     segment_fields = [fields]
   assert len(segments) == num_segments
   assert len(segment_fields) == num_segments
@@ -157,46 +192,72 @@ def _GetSegmentData(data):
   Args:
     data: String that contains all the characters in a segment's worth of data.
   Returns:
-    List of lists of dictionaries.
+    Tuple of (names, values, num_rows):
+      names: List of the column names in the segment.
+      values: (num_patches, len(names)) array of the numeric patch data,
+        ordered as in the file (along-strike fastest).
+      num_rows: Number of down-dip rows. Every row holds the same number of
+        along-strike patches, so len(values) / num_rows is the row width.
   """
-  ret = []
-  rows = []
-  names = []
-  last_z = None
-  for line in data.split('\n'):
-    if not line: continue  # Skip blank lines
-    if DATA_FIELDS_RE.match(line):  # Find field names
-      # We extract the names of the fields.
-      # The field names will be a in a string of the following form:
-      #
-      #     '%     F1   F2    F3==X     Z'
-      #
-      # First we split up the string by removing all spaces, discard the first
-      # one ('%'), and then we remove any pieces after and including '=' in the
-      # field name. NB: The last row must be a 'Z'
-      names = [x.upper() for x in line.split()[1:]]
-      names = [x.split('=')[0] if '=' in x else x for x in names]
-    if line[0] == '%':  # Skip comment lines.
-      continue
-    else:
-      # Make a dict of our values.
-      val = {n: float(v) for n, v in zip(names, line.split())}
-      assert -180. <= val['LON'] <= 180.
-      assert -90. <= val['LAT'] <= 90.
-
-      # If the z value we've just read in doesn't equal the last z value we've
-      # read in, we have a new row. We then save off the row we've read so far
-      # before adding the new value to the rows.
-      if last_z is not None and val['Z'] != last_z:
-        ret.append(rows)
-        assert len(ret[0]) == len(ret[-1])  # Is same length as previous?
-        rows = []
-      rows.append(val)
-      last_z = val['Z']
-  if rows:
-    ret.append(rows)
-  assert len(ret[0]) == len(ret[-1])  # Is same length as previous?
-  return ret
+  # We extract the names of the fields from the header line.
+  # The field names will be a in a string of the following form:
+  #
+  #     '%     F1   F2    F3==X     Z'
+  #
+  # First we split up the string by removing all spaces, discard the first
+  # one ('%'), and then we remove any pieces after and including '=' in the
+  # field name. NB: The last row must be a 'Z'
+  header = DATA_FIELDS_RE.search(data)
+  assert header
+  names = [x.upper() for x in header.group(0).split()[1:]]
+  names = [x.split('=')[0] if '=' in x else x for x in names]
+
+  # One linear regex sweep pulls out the numeric rows; splitting the segment
+  # into per-line strings and filtering them in Python allocated a string for
+  # every line, comments included.
+  numeric_lines = NUMERIC_LINE_RE.findall(data)
+
+  # Parse the whole numeric block in one shot rather than one float() call
+  # per value -- the tokenizing and casts all happen in C.
+  values = np.fromstring(' '.join(numeric_lines), sep=' ')
+  assert values.size == len(numeric_lines) * len(names)
+  values = values.reshape(len(numeric_lines), len(names))
+  lon = values[:, names.index('LON')]
+  lat = values[:, names.index('LAT')]
+  assert ((-180. <= lon) & (lon <= 180.)).all()
+  assert ((-90. <= lat) & (lat <= 90.)).all()
+
+  # A new row starts wherever the z value changes, and every row must have
+  # the same number of patches.
+  boundaries = np.flatnonzero(np.diff(values[:, names.index('Z')])) + 1
+  row_starts = np.concatenate(([0], boundaries, [len(values)]))
+  row_lengths = np.diff(row_starts)
+  assert (row_lengths == row_lengths[0]).all()  # Are all the same length?
+
+  return names, values, len(row_lengths)
+
+
+# Cache of UTM projections keyed by (zone number, zone letter). There are
+# only ~1200 possible zones and building a pyproj.Proj parses an init string
+# and allocates a PROJ context each time, so share them across files.
+_proj_cache = {}
+
+
+def _GetUtmProj(number, letter):
+  """Returns a (cached) UTM pyproj.Proj for the given zone."""
+  key = (number, letter)
+  if key not in _proj_cache:
+    _proj_cache[key] = pyproj.Proj(proj='utm',
+                                   zone='{}{}'.format(number, letter),
+                                   ellps='WGS84')
+  return _proj_cache[key]
+
+
+# Cache of parsed srcmod data keyed by filename. Parsing pulls the file down
+# from GCS, so warm calls (retries, or runs at another depth for the same
+# quake) skip the network and the parse entirely. We hand out shallow copies
+# because ModelQuake deletes the projEpicenter entry from its result.
+_read_srcmod_cache = {}
 
 
 def ReadSrcmodFile(filename):
@@ -207,6 +268,10 @@ def ReadSrcmodFile(filename):
   Returns:
     List of dictionaries. Each dictionary is a single segment of the fault.
   """
+  if filename in _read_srcmod_cache:
+    logging.info('Using cached SRCMOD file: %s', filename)
+    return dict(_read_srcmod_cache[filename])
+
   logging.info('Reading SRCMOD file: %s', filename)
 
   src_mod = collections.defaultdict(list)
@@ -226,7 +291,7 @@ def ReadSrcmodFile(filename):
     # Remap tags to src_mod output.
     for in_name, out_name in TAG_MAP:
       if in_name not in tags:
-        print 'error', in_name, tags
+        logging.warning('Missing tag %s in %r', in_name, tags)
         continue
       src_mod[out_name] = tags[in_name]
 
@@ -234,7 +299,7 @@ def ReadSrcmodFile(filename):
     fields = _FindFields(data)
     for in_name, out_name in FIELD_MAP:
       if in_name not in fields:
-        print 'error', in_name, fields
+        logging.warning('Missing field %s in %r', in_name, fields)
         continue
       src_mod[out_name] = fields[in_name]
 
@@ -243,8 +308,7 @@ def ReadSrcmodFile(filename):
                                            src_mod['epicenterLongitude'])
     src_mod['zoneNumber'] = number
     src_mod['zoneLetter'] = letter
-    proj = pyproj.Proj(proj='utm', zone='{}{}'.format(number, letter),
-                       ellps='WGS84')
+    proj = _GetUtmProj(number, letter)
     src_mod['projEpicenter'] = proj
     src_mod['epicenterXUtm'], src_mod['epicenterYUtm'] = proj(
         src_mod['epicenterLongitude'], src_mod['epicenterLatitude'])
@@ -253,24 +317,38 @@ def ReadSrcmodFile(filename):
     num_segments = int(fields['NSG'])
     segments, segment_fields = _SeparateSegments(num_segments, fields, data)
 
+    # Parse every segment's numeric block up front so we know the total patch
+    # count, then preallocate one contiguous float64 column per field. The
+    # per-segment fills below are whole-column broadcasts; growing 30+ Python
+    # lists one boxed float at a time was both slower and ~3x the memory.
+    segment_data = [_GetSegmentData(seg) for seg in segments]
+    num_patches = sum(len(values) for _, values, num_rows in segment_data
+                      if num_rows > 1)
+    for field in PATCH_FIELDS:
+      src_mod[field] = np.empty(num_patches)
+    idx = 0
+
     # Loop through the segments.
     for i in range(num_segments):
-      if segment_fields[i].has_key('STRIKE'):
-        seg_strike = segment_fields[i]['STRIKE']
-      else:
-        seg_strike = fields['STRK']
+      # Resolve the per-segment scalars once up front, falling back to the
+      # file-level header fields where a segment doesn't define its own.
+      seg_fields = segment_fields[i]
+      seg_strike = seg_fields.get('STRIKE', fields['STRK'])
+      seg_dip = seg_fields['DIP']
       angle = -(seg_strike-90)
       if angle < 0:
         angle += 360
 
-      data = _GetSegmentData(segments[i])
-      if len(data) == 1: continue  # Skip short segments.
+      names, values, num_rows = segment_data[i]
+      if num_rows == 1: continue  # Skip short segments.
+      num_seg_patches = len(values)
+      num_strike = num_seg_patches // num_rows
 
       # Calculate the length and wide if individual patch elements in current
       # panel.
-      length = segment_fields[i].get('DX', fields['DX'])
-      if segment_fields[i].has_key('LEN'):
-        width = segment_fields[i]['LEN'] / len(data)
+      length = seg_fields.get('DX', fields['DX'])
+      if 'LEN' in seg_fields:
+        width = seg_fields['LEN'] / num_rows
       else:
         width = fields['DZ']
 
@@ -313,96 +391,106 @@ def ReadSrcmodFile(filename):
       # xyz3  +----------------+ xyz4  --v
       #
       # We do this remaping with a number of different transforms for x, y, and
-      # z.
+      # z. Every patch in the panel shares the same offsets, so each output
+      # field is filled with a single broadcast over the panel's columns.
       #
       # [*] strikeslip is the angle the fault, and slip as the two plates move
       # laterally across each other. dipslip is the angle of the fault as the
       # two plates move under/over each other.
-      rot = np.array([[math.cos(math.radians(angle)),
-                       -math.sin(math.radians(angle))],
-                      [math.sin(math.radians(angle)),
-                       math.cos(math.radians(angle))]])
-      x_orig = np.array([[length / 2.0], [0.0]])
-      x_rot = np.dot(rot, x_orig)
-      x_top_offset = x_rot[0] * KM2M
-      y_top_offset = x_rot[1] * KM2M
-      x_top_bottom_offset = (data[1][0]['X'] - data[0][0]['X']) * KM2M
-      y_top_bottom_offset = (data[1][0]['Y'] - data[0][0]['Y']) * KM2M
-      z_top_bottom_offset = (data[1][0]['Z'] - data[0][0]['Z']) * KM2M
-
-      # Loops over the down-dip and along-strike patches of the current panel
-      for dip in range(0, len(data)):
-        for strike in range(0, len(data[0])):
-          # Extract top center coordinates of current patch
-          x_top_center = data[dip][strike]['X'] * KM2M
-          y_top_center = data[dip][strike]['Y'] * KM2M
-          z_top_center = data[dip][strike]['Z'] * KM2M
-          src_mod['patchLongitude'].append(data[dip][strike]['LON'])
-          src_mod['patchLatitude'].append(data[dip][strike]['LAT'])
-
-          # Calculate location of top corners and convert from km to m
-          src_mod['x1'].append(x_top_center + x_top_offset)
-          src_mod['y1'].append(y_top_center + y_top_offset)
-          src_mod['z1'].append(z_top_center)
-          src_mod['x2'].append(x_top_center - x_top_offset)
-          src_mod['y2'].append(y_top_center - y_top_offset)
-          src_mod['z2'].append(z_top_center)
-
-          # Calculate location of bottom corners and convert from km to m
-          src_mod['x3'].append(x_top_center + x_top_bottom_offset +
+      # The offset is the patch half-length rotated through the segment
+      # angle; with a zero y component the 2x2 rotation collapses to two
+      # scalar products, so skip building the matrix.
+      angle_radians = math.radians(angle)
+      x_top_offset = math.cos(angle_radians) * length / 2.0 * KM2M
+      y_top_offset = math.sin(angle_radians) * length / 2.0 * KM2M
+      x_col = names.index('X')
+      y_col = names.index('Y')
+      z_col = names.index('Z')
+      x_top_bottom_offset = (values[num_strike, x_col] -
+                             values[0, x_col]) * KM2M
+      y_top_bottom_offset = (values[num_strike, y_col] -
+                             values[0, y_col]) * KM2M
+      z_top_bottom_offset = (values[num_strike, z_col] -
+                             values[0, z_col]) * KM2M
+
+      # Extract the top center coordinates of the whole panel at once.
+      seg = slice(idx, idx + num_seg_patches)
+      x_top_center = values[:, x_col] * KM2M
+      y_top_center = values[:, y_col] * KM2M
+      z_top_center = values[:, z_col] * KM2M
+      lon = values[:, names.index('LON')]
+      lat = values[:, names.index('LAT')]
+      src_mod['patchLongitude'][seg] = lon
+      src_mod['patchLatitude'][seg] = lat
+
+      # Calculate location of top corners and convert from km to m
+      src_mod['x1'][seg] = x_top_center + x_top_offset
+      src_mod['y1'][seg] = y_top_center + y_top_offset
+      src_mod['z1'][seg] = z_top_center
+      src_mod['x2'][seg] = x_top_center - x_top_offset
+      src_mod['y2'][seg] = y_top_center - y_top_offset
+      src_mod['z2'][seg] = z_top_center
+
+      # Calculate location of bottom corners and convert from km to m
+      src_mod['x3'][seg] = (x_top_center + x_top_bottom_offset + x_top_offset)
+      src_mod['y3'][seg] = (y_top_center + y_top_bottom_offset + y_top_offset)
+      src_mod['z3'][seg] = z_top_center + z_top_bottom_offset
+      src_mod['x4'][seg] = (x_top_center + x_top_bottom_offset - x_top_offset)
+      src_mod['y4'][seg] = (y_top_center + y_top_bottom_offset - y_top_offset)
+      src_mod['z4'][seg] = z_top_center + z_top_bottom_offset
+
+      # Create UTM version of the same. One proj call projects the whole
+      # panel; pyproj dispatches arrays through a single C entry point. (The
+      # old per-patch version also overwrote patchXUtm/patchYUtm with the
+      # last patch's scalar instead of keeping them all; they're full
+      # per-patch columns now.)
+      x_top_center_utm, y_top_center_utm = proj(lon, lat)
+      src_mod['patchXUtm'][seg] = x_top_center_utm
+      src_mod['patchYUtm'][seg] = y_top_center_utm
+      src_mod['x1Utm'][seg] = x_top_center_utm + x_top_offset
+      src_mod['y1Utm'][seg] = y_top_center_utm + y_top_offset
+      src_mod['z1Utm'][seg] = z_top_center
+      src_mod['x2Utm'][seg] = x_top_center_utm - x_top_offset
+      src_mod['y2Utm'][seg] = y_top_center_utm - y_top_offset
+      src_mod['z2Utm'][seg] = z_top_center
+      src_mod['x3Utm'][seg] = (x_top_center_utm + x_top_bottom_offset +
                                x_top_offset)
-          src_mod['y3'].append(y_top_center + y_top_bottom_offset +
+      src_mod['y3Utm'][seg] = (y_top_center_utm + y_top_bottom_offset +
                                y_top_offset)
-          src_mod['z3'].append(z_top_center + z_top_bottom_offset)
-          src_mod['x4'].append(x_top_center + x_top_bottom_offset -
+      src_mod['z3Utm'][seg] = z_top_center + z_top_bottom_offset
+      src_mod['x4Utm'][seg] = (x_top_center_utm + x_top_bottom_offset -
                                x_top_offset)
-          src_mod['y4'].append(y_top_center + y_top_bottom_offset -
+      src_mod['y4Utm'][seg] = (y_top_center_utm + y_top_bottom_offset -
                                y_top_offset)
-          src_mod['z4'].append(z_top_center + z_top_bottom_offset)
-
-          # Create UTM version of the same
-          x_top_center_utm, y_top_center_utm = proj(
-              src_mod['patchLongitude'][-1], src_mod['patchLatitude'][-1])
-          src_mod['patchXUtm'] = x_top_center_utm
-          src_mod['patchYUtm'] = y_top_center_utm
-          src_mod['x1Utm'].append(x_top_center_utm + x_top_offset)
-          src_mod['y1Utm'].append(y_top_center_utm + y_top_offset)
-          src_mod['z1Utm'].append(z_top_center)
-          src_mod['x2Utm'].append(x_top_center_utm - x_top_offset)
-          src_mod['y2Utm'].append(y_top_center_utm - y_top_offset)
-          src_mod['z2Utm'].append(z_top_center)
-          src_mod['x3Utm'].append(x_top_center_utm + (x_top_bottom_offset +
-                                                      x_top_offset))
-          src_mod['y3Utm'].append(y_top_center_utm + (y_top_bottom_offset +
-                                                      y_top_offset))
-          src_mod['z3Utm'].append(z_top_center + z_top_bottom_offset)
-          src_mod['x4Utm'].append(x_top_center_utm + (x_top_bottom_offset -
-                                                      x_top_offset))
-          src_mod['y4Utm'].append(y_top_center_utm + (y_top_bottom_offset -
-                                                      y_top_offset))
-          src_mod['z4Utm'].append(z_top_center + z_top_bottom_offset)
-
-          # Extract patch dip, strike, width, and length
-          # NB: dipMean and strikeMean are not length weighted
-          src_mod['dip'].append(segment_fields[i]['DIP'])
-          src_mod['strike'].append(seg_strike)
-          src_mod['dipMean'] = np.mean(np.array(src_mod['dip']))
-          src_mod['strikeMean'] = np.mean(np.array(src_mod['strike']))
-          src_mod['rake'].append(data[dip][strike].get('RAKE', 0))
-          src_mod['angle'].append(angle)
-          src_mod['width'].append(KM2M * width)
-          src_mod['length'].append(KM2M * length)
-
-          # Extract fault slip
-          src_mod['slip'].append(data[dip][strike]['SLIP'])
-          rot = np.array([[math.cos(math.radians(src_mod['rake'][-1])),
-                           -math.sin(math.radians(src_mod['rake'][-1]))],
-                          [math.sin(math.radians(src_mod['rake'][-1])),
-                           math.cos(math.radians(src_mod['rake'][-1]))]])
-          x_orig = np.array([[src_mod['slip'][-1]], [0]])
-          x_rot = np.dot(rot, x_orig)
-          src_mod['slipStrike'].append(x_rot[0])
-          src_mod['slipDip'].append(x_rot[1])
+      src_mod['z4Utm'][seg] = z_top_center + z_top_bottom_offset
+
+      # Extract patch dip, strike, width, and length
+      # NB: dipMean and strikeMean are not length weighted
+      src_mod['dip'][seg] = seg_dip
+      src_mod['strike'][seg] = seg_strike
+      src_mod['angle'][seg] = angle
+      src_mod['width'][seg] = KM2M * width
+      src_mod['length'][seg] = KM2M * length
+
+      # Extract fault slip, decomposed along strike and dip by the rake.
+      slip = values[:, names.index('SLIP')]
+      if 'RAKE' in names:
+        rake = values[:, names.index('RAKE')]
+      else:
+        rake = np.zeros(num_seg_patches)
+      rake_radians = np.radians(rake)
+      src_mod['rake'][seg] = rake
+      src_mod['slip'][seg] = slip
+      src_mod['slipStrike'][seg] = np.cos(rake_radians) * slip
+      src_mod['slipDip'][seg] = np.sin(rake_radians) * slip
+
+      idx += num_seg_patches
+
+    # NB: dipMean and strikeMean are not length weighted. One reduction over
+    # the finished columns; these used to be recomputed per patch over the
+    # growing lists, which was quadratic.
+    src_mod['dipMean'] = np.mean(src_mod['dip'])
+    src_mod['strikeMean'] = np.mean(src_mod['strike'])
 
   # Check that our dips and strikes are within proper ranges.
   for dip in src_mod['dip']:
@@ -412,4 +500,5 @@ def ReadSrcmodFile(filename):
 
   logging.info('Done reading SRCMOD file %s', filename)
 
-  return src_mod
+  _read_srcmod_cache[filename] = src_mod
+  return dict(src_mod)